@@ -1,20 +1,45 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Query, Header, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 import shutil
+import csv
+import io
+import json
+import asyncio
+import hashlib
+import time
+import re
+import orjson
+import zlib
+import smtplib
+import tempfile
+from collections import OrderedDict
+from email.message import EmailMessage
+from urllib.parse import urlparse, unquote
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, TypeAdapter
+from pymongo import UpdateOne, ReplaceOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta, date
 import bcrypt
 import jwt
 from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -27,9 +52,104 @@ db = client[os.environ['DB_NAME']]
 # JWT configuration
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '7'))
+TOKEN_VERSION_CACHE_SECONDS = int(os.environ.get('TOKEN_VERSION_CACHE_SECONDS', '10'))
+TOKEN_VERSION_CACHE_MAX_ENTRIES = 10000
+# Changing any of these invalidates the user's tokens, since they are carried in the claims
+TOKEN_CLAIM_FIELDS = {"role", "agency_name", "is_active", "password_hash"}
+
+# Bulk import configuration
+BULK_IMPORT_BATCH_SIZE = 500
+BULK_IMPORT_MAX_ROWS = 20000
+BULK_UPDATE_MAX_ITEMS = 5000
+
+# Reservation list count cache
+COUNT_CACHE_TTL_SECONDS = 30
+COUNT_CACHE_MAX_ENTRIES = 1000
+
+# Agency statement configuration
+STATEMENT_MAX_PAGE_SIZE = 1000
+STATEMENT_CURSOR_EXPIRE_MINUTES = int(os.environ.get('STATEMENT_CURSOR_EXPIRE_MINUTES', '60'))
+# Pagination cursors are signed apart from auth tokens, so one can never stand in for the other
+CURSOR_SECRET_KEY = os.environ.get('CURSOR_SECRET_KEY', f"{SECRET_KEY}:cursor")
+
+# Balance snapshot configuration
+BALANCE_SNAPSHOT_PERIOD_MONTHS = int(os.environ.get('BALANCE_SNAPSHOT_PERIOD_MONTHS', '1'))
+BALANCE_SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get('BALANCE_SNAPSHOT_INTERVAL_SECONDS', str(6 * 60 * 60)))
+
+# Balance reconciliation configuration
+BALANCE_RECONCILIATION_INTERVAL_SECONDS = int(os.environ.get('BALANCE_RECONCILIATION_INTERVAL_SECONDS', str(24 * 60 * 60)))
+BALANCE_RECONCILIATION_AUTO_CORRECT = os.environ.get('BALANCE_RECONCILIATION_AUTO_CORRECT', 'false').lower() == 'true'
+
+# Background job queue configuration
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_PROCESS_WORKERS = int(os.environ.get('JOB_PROCESS_WORKERS', '2'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '2'))
+JOB_RETRY_DELAY_SECONDS = int(os.environ.get('JOB_RETRY_DELAY_SECONDS', '30'))
+JOB_RESULTS_DIR = Path(os.environ.get('JOB_RESULTS_DIR', '/app/job_results'))
+
+# Archive configuration
+# Paid reservations and closed requests move to *_archive collections this many months after the service/stay
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', '12'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', str(24 * 60 * 60)))
 
-app = FastAPI()
+# Native date configuration
+# String date fields mirrored as BSON dates under "dates", which range queries use once the migration has run
+DATE_FIELDS = {
+    "reservations": ("date_of_issue", "date_of_service", "last_date_of_payment", "created_at"),
+    "topups": ("date", "created_at"),
+    "expenses": ("date", "created_at"),
+    "reservations_archive": ("date_of_issue", "date_of_service", "last_date_of_payment", "created_at"),
+    "tourists": ("document_expiration",)
+}
+DATE_MIGRATION_BATCH_SIZE = int(os.environ.get('DATE_MIGRATION_BATCH_SIZE', '1000'))
+DATE_MIGRATION_CHECK_SECONDS = 60
+
+# Delta sync configuration
+SYNC_COLLECTIONS = ("reservations", "requests", "comments", "topups", "expenses")
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+# Changes stamped this close to a sync are read again by the next one, as their write may not have been visible yet
+SYNC_OVERLAP_SECONDS = 5
+# Tombstones are kept this long; older sync tokens have to start over with a full sync
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', '30'))
+
+# Payment alert configuration
+PAYMENT_ALERT_INTERVAL_SECONDS = int(os.environ.get('PAYMENT_ALERT_INTERVAL_SECONDS', str(6 * 60 * 60)))
+PAYMENT_ALERT_EMAIL_ATTEMPTS = 3
+# Items are alerted as they become overdue; older ones were alerted by an earlier scan, so scans stop looking that far back
+PAYMENT_ALERT_OVERDUE_DAYS = int(os.environ.get('PAYMENT_ALERT_OVERDUE_DAYS', '30'))
+# A digest claimed for sending longer ago than this is assumed abandoned and sent again
+PAYMENT_ALERT_EMAIL_CLAIM_SECONDS = 300
+# file:///path writes every email as an .eml file there, smtp(s)://user:password@host:port sends it
+EMAIL_SENDER_URL = os.environ.get('EMAIL_SENDER_URL', 'file:///app/outbox')
+EMAIL_FROM = os.environ.get('EMAIL_FROM', 'b2b@4travels.net')
+
+# Monthly statement files
+STATEMENT_FILES_DIR = JOB_RESULTS_DIR / "statements"
+
+# Idempotency key configuration
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', str(24 * 60 * 60)))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Response cache configuration
+# memory:// keeps a per-process LRU, redis://host:port/db shares entries between workers
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', 'memory://')
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '300'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Response compression configuration
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+
+app = FastAPI(default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
 
@@ -62,6 +182,11 @@ class TokenResponse(BaseModel):
     access_token: str
     token_type: str
     user: UserResponse
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class PasswordChange(BaseModel):
     old_password: str
@@ -131,6 +256,17 @@ class TouristResponse(BaseModel):
     created_at: str
     updated_at: str
 
+class TravelAfterExpiry(BaseModel):
+    reservation_id: str
+    agency_id: str
+    agency_name: str
+    service_type: str
+    date_of_service: str
+
+class ExpiringTouristResponse(TouristResponse):
+    days_left: int
+    travels_after_expiry: List[TravelAfterExpiry] = []
+
 class ReservationCreate(BaseModel):
     agency_id: str
     agency_name: str
@@ -197,9 +333,62 @@ class ReservationResponse(BaseModel):
     created_at: str
     updated_at: str
 
+# Supplier and revenue fields are never shown to sub-agencies
+RESERVATION_ADMIN_ONLY_FIELDS = [
+    "supplier_id",
+    "supplier_name",
+    "supplier_price",
+    "supplier_prepayment_amount",
+    "revenue",
+    "revenue_percentage"
+]
+
+RESERVATION_FIELDS = list(ReservationResponse.model_fields)
+
+# Named field profiles for the reservation list, selected with ?view=
+RESERVATION_VIEWS = {
+    "list": [
+        "id",
+        "agency_id",
+        "agency_name",
+        "date_of_issue",
+        "service_type",
+        "date_of_service",
+        "tourist_names",
+        "price",
+        "actual_date_of_full_payment",
+        "actual_date_of_prepayment",
+        "prepayment_amount",
+        "rest_amount_of_payment",
+        "last_date_of_payment",
+        "supplier_name",
+        "supplier_price",
+        "supplier_prepayment_amount",
+        "revenue",
+        "revenue_percentage"
+    ]
+}
+
+PAYMENT_STATUS_FIELDS = ["prepayment_amount", "rest_amount_of_payment", "last_date_of_payment"]
+
+RESERVATION_FACETS = ("service_type", "payment_status", "agency")
+
+RESERVATION_COUNT_STRATEGIES = ("exact", "cached", "has_more")
+
 class MarkAsPaid(BaseModel):
     pass
 
+class ReservationBulkFilter(BaseModel):
+    agency_id: Optional[str] = None
+    search: Optional[str] = None
+    service_type: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+class ReservationBulkMarkPaid(BaseModel):
+    ids: Optional[List[str]] = None
+    filter: Optional[ReservationBulkFilter] = None
+
 class SettingsResponse(BaseModel):
     upcoming_due_threshold_days: int
 
@@ -246,6 +435,20 @@ class RequestUpdate(BaseModel):
     payment_status: Optional[str] = None
     document_status: Optional[str] = None
 
+REQUEST_STATUS_FIELDS = ("reservation_status", "payment_status", "document_status")
+
+REQUEST_SORT_FIELDS = ("created_at", "updated_at", "check_in", "check_out", "country")
+
+class RequestBulkFilter(BaseModel):
+    agency_id: Optional[str] = None
+    reservation_status: Optional[str] = None
+    payment_status: Optional[str] = None
+    document_status: Optional[str] = None
+
+class RequestBulkUpdate(RequestUpdate):
+    ids: Optional[List[str]] = None
+    filter: Optional[RequestBulkFilter] = None
+
 class CommentCreate(BaseModel):
     text: str
 
@@ -301,29 +504,86 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def create_access_token(data: dict) -> str:
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def issue_tokens(user: dict) -> dict:
+    version = user.get("token_version", 0)
+    access_token = create_access_token({
+        "sub": user["id"],
+        "type": "access",
+        "role": user["role"],
+        "agency_name": user.get("agency_name", ""),
+        "ver": version
+    })
+    # Every refresh token can be exchanged once; its jti is recorded so reuse can be detected
+    jti = str(uuid.uuid4())
+    await db.refresh_tokens.insert_one({
+        "jti": jti,
+        "user_id": user["id"],
+        "used_at": None,
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    })
+    refresh_token = create_access_token(
+        {"sub": user["id"], "type": "refresh", "ver": version, "jti": jti},
+        timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    return {"access_token": access_token, "refresh_token": refresh_token, "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60}
+
+token_version_cache: Dict[str, tuple] = {}
+
+async def current_token_version(user_id: str) -> Optional[int]:
+    now = time.monotonic()
+    cached = token_version_cache.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+    
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "token_version": 1})
+    version = user.get("token_version", 0) if user is not None else None
+    
+    if len(token_version_cache) >= TOKEN_VERSION_CACHE_MAX_ENTRIES:
+        token_version_cache.clear()
+    token_version_cache[user_id] = (version, now + TOKEN_VERSION_CACHE_SECONDS)
+    return version
+
+async def revoke_user_tokens(user_id: str):
+    # Other workers notice within TOKEN_VERSION_CACHE_SECONDS
+    await db.users.update_one({"id": user_id}, {"$inc": {"token_version": 1}})
+    token_version_cache.pop(user_id, None)
+
+async def decode_token(token: str, token_type: str) -> dict:
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
+    
+    if payload.get("sub") is None or payload.get("type") != token_type or "ver" not in payload:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    if token_type == "refresh" and not payload.get("jti"):
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    
+    version = await current_token_version(payload["sub"])
+    if version is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if version != payload["ver"]:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return payload
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Authorizes from the claims alone; use get_current_user_record for the stored profile
+    payload = await decode_token(credentials.credentials, "access")
+    return {"id": payload["sub"], "role": payload["role"], "agency_name": payload.get("agency_name", "")}
+
+async def get_current_user_record(current_user: dict = Depends(get_current_user)):
+    user = await db.users.find_one({"id": current_user["id"]}, {"_id": 0})
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
 
 async def require_admin(user: dict = Depends(get_current_user)):
     if user["role"] != "admin":
@@ -362,6 +622,446 @@ async def startup_event():
         }
         await db.settings.insert_one(default_settings)
         logger.info("Default settings created")
+    
+    await create_indexes()
+    await backfill_updated_at()
+    await ensure_job_slots()
+    await start_native_dates_migration()
+    
+    schedule_periodic("balance snapshots", BALANCE_SNAPSHOT_INTERVAL_SECONDS, create_balance_snapshots)
+    schedule_periodic("balance reconciliation", BALANCE_RECONCILIATION_INTERVAL_SECONDS, scheduled_balance_reconciliation)
+    # Queued rather than run here so the job queue keeps archive runs from overlapping
+    schedule_periodic("archive", ARCHIVE_INTERVAL_SECONDS, lambda: enqueue_scheduled_job("archive", ARCHIVE_INTERVAL_SECONDS))
+    schedule_periodic("payment alerts", PAYMENT_ALERT_INTERVAL_SECONDS, lambda: enqueue_scheduled_job("payment_alerts", PAYMENT_ALERT_INTERVAL_SECONDS))
+    # Picks up a migration finished by another worker
+    schedule_periodic("native dates check", DATE_MIGRATION_CHECK_SECONDS, refresh_native_dates_ready)
+    start_job_workers()
+
+background_tasks: List[asyncio.Task] = []
+
+def schedule_periodic(name: str, interval_seconds: int, job):
+    async def runner():
+        while True:
+            try:
+                await job()
+            except Exception:
+                logger.exception(f"Scheduled job failed: {name}")
+            await asyncio.sleep(interval_seconds)
+    
+    if interval_seconds > 0:
+        background_tasks.append(asyncio.create_task(runner()))
+
+async def create_indexes():
+    await db.requests.create_index("id", unique=True)
+    # The request list pages through find() sorted by (sort field, id), narrowed by agency and status
+    await db.requests.create_index([("agency_id", 1), ("created_at", -1), ("id", -1)])
+    for field in REQUEST_STATUS_FIELDS:
+        await db.requests.create_index([(field, 1), ("created_at", -1), ("id", -1)])
+        await db.requests.create_index([("agency_id", 1), (field, 1), ("created_at", -1), ("id", -1)])
+    await db.requests.create_index([("agency_id", 1), ("country", 1), ("check_in", 1)])
+    await db.requests.create_index([("country", 1), ("check_in", 1)])
+    await db.requests.create_index("check_in")
+    await db.balance_snapshots.create_index([("agency_id", 1), ("as_of", -1)], unique=True)
+    await db.topups.create_index([("agency_id", 1), ("date", 1)])
+    await db.expenses.create_index([("agency_id", 1), ("date", 1)])
+    await db.reservations.create_index([("agency_id", 1), ("date_of_issue", 1)])
+    await db.reservations.create_index("dates.date_of_service")
+    await db.reservations.create_index([("agency_id", 1), ("dates.date_of_service", 1)])
+    await db.reservations.create_index([("agency_id", 1), ("dates.date_of_issue", 1)])
+    await db.topups.create_index([("agency_id", 1), ("dates.date", 1)])
+    await db.expenses.create_index([("agency_id", 1), ("dates.date", 1)])
+    await db.requests.create_index([("reservation_status", 1), ("check_out", 1)])
+    await db.tourists.create_index("dates.document_expiration")
+    await db.tourists.create_index("document_expiration")
+    await db.reservations_archive.create_index("id", unique=True)
+    await db.reservations_archive.create_index([("agency_id", 1), ("dates.date_of_issue", 1)])
+    await db.requests_archive.create_index("id", unique=True)
+    await db.requests_archive.create_index([("agency_id", 1), ("created_at", -1)])
+    await db.comments_archive.create_index("id", unique=True)
+    await db.comments_archive.create_index("request_id")
+    await db.documents_archive.create_index("id", unique=True)
+    await db.documents_archive.create_index("request_id")
+    await db.reconciliation_reports.create_index([("created_at", -1)])
+    await db.jobs.create_index("id", unique=True)
+    await db.jobs.create_index("schedule_key", unique=True, sparse=True)
+    await db.jobs.create_index([("status", 1), ("type", 1), ("created_at", 1)])
+    await db.jobs.create_index([("created_by", 1), ("created_at", -1)])
+    await db.job_slots.create_index([("type", 1), ("index", 1)])
+    await db.statement_files.create_index([("agency_id", 1), ("period", 1), ("format", 1), ("data_version", 1)], unique=True)
+    for name in SYNC_COLLECTIONS:
+        await db[name].create_index([("updated_at", 1), ("id", 1)])
+        if name != "comments":
+            await db[name].create_index([("agency_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.tombstones.create_index([("agency_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.tombstones.create_index([("updated_at", 1), ("id", 1)])
+    await db.tombstones.create_index("expires_at", expireAfterSeconds=0)
+    await db.reservations.create_index([("rest_amount_of_payment", 1), ("last_date_of_payment", 1)])
+    await db.reservations.create_index([("rest_amount_of_payment", 1), ("dates.last_date_of_payment", 1)])
+    await db.payment_alerts.create_index([("reservation_id", 1), ("kind", 1), ("due_date", 1)], unique=True)
+    await db.notifications.create_index("id", unique=True)
+    await db.notifications.create_index([("agency_id", 1), ("created_at", -1)])
+    await db.notifications.create_index([("created_at", -1)])
+    await db.notifications.create_index("email_status")
+    await db.refresh_tokens.create_index("jti", unique=True)
+    await db.refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.idempotency_keys.create_index("key", unique=True)
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_KEY_TTL_SECONDS)
+
+# Idempotency keys
+async def renew_idempotency_lock(record_key: str, lock_id: str):
+    # Keeps a slow operation from looking abandoned to a retry
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+        await db.idempotency_keys.update_one(
+            {"key": record_key, "lock_id": lock_id, "status": "pending"},
+            {"$set": {"locked_until": datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+        )
+
+async def run_idempotent(idempotency_key: Optional[str], user: dict, scope: str, payload: Any, operation):
+    if not idempotency_key:
+        return await operation()
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    
+    record_key = f"{user['id']}:{scope}:{idempotency_key}"
+    request_hash = hashlib.sha256(json.dumps(jsonable_encoder(payload), sort_keys=True).encode()).hexdigest()
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    lock_id = str(uuid.uuid4())
+    
+    while True:
+        now = datetime.now(timezone.utc)
+        # Claims the key when it is new, otherwise returns the stored record in the same round trip
+        try:
+            record = await db.idempotency_keys.find_one_and_update(
+                {"key": record_key},
+                {"$setOnInsert": {
+                    "key": record_key,
+                    "request_hash": request_hash,
+                    "status": "pending",
+                    "response": None,
+                    "created_at": now,
+                    "lock_id": lock_id,
+                    "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+                }},
+                projection={"_id": 0, "request_hash": 1, "status": 1, "response": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            continue
+        
+        if record is None:
+            break
+        if record["request_hash"] != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if record["status"] == "completed":
+            return record["response"]
+        
+        # Take over keys whose first request died without finishing
+        abandoned = await db.idempotency_keys.find_one_and_update(
+            {"key": record_key, "status": "pending", "locked_until": {"$lt": now}},
+            {"$set": {"lock_id": lock_id, "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+            projection={"_id": 1}
+        )
+        if abandoned:
+            break
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+    
+    heartbeat = asyncio.create_task(renew_idempotency_lock(record_key, lock_id))
+    completed = False
+    try:
+        result = await operation()
+        await db.idempotency_keys.update_one(
+            {"key": record_key, "lock_id": lock_id},
+            {"$set": {"status": "completed", "response": jsonable_encoder(result)}}
+        )
+        completed = True
+        return result
+    finally:
+        heartbeat.cancel()
+        if not completed:
+            # Failed or cancelled requests are not remembered so the client can retry them
+            await db.idempotency_keys.delete_one({"key": record_key, "status": "pending", "lock_id": lock_id})
+
+# Native dates
+native_dates_ready = False
+
+def parse_stored_date(value: Any) -> Optional[datetime]:
+    # Stored values are ISO dates or timestamps; anything else gets no native date
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def parse_query_date(value: str) -> datetime:
+    parsed = parse_stored_date(value)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    return parsed
+
+def with_native_dates(collection: str, doc: dict) -> dict:
+    doc["dates"] = {field: parse_stored_date(doc.get(field)) for field in DATE_FIELDS[collection]}
+    return doc
+
+def native_date_updates(collection: str, update: dict) -> dict:
+    return {f"dates.{field}": parse_stored_date(update[field]) for field in DATE_FIELDS[collection] if field in update}
+
+def date_range_query(field: str, bounds: dict) -> dict:
+    # Bounds stay in the API's string format; until every document has native dates the strings are compared
+    if not native_dates_ready:
+        return {field: bounds}
+    return {f"dates.{field}": {op: parse_query_date(value) for op, value in bounds.items()}}
+
+async def refresh_native_dates_ready():
+    global native_dates_ready
+    if not native_dates_ready:
+        migration = await db.migrations.find_one({"_id": "native_dates"})
+        # A migration finished before a collection joined DATE_FIELDS has to run again for it
+        native_dates_ready = bool(
+            migration and migration.get("completed_at")
+            and set(DATE_FIELDS) <= set(migration.get("collections", []))
+        )
+
+# Fast serialization
+@lru_cache(maxsize=None)
+def list_adapter(model) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+def dump_model_list(model, rows: List[dict]) -> list:
+    # Validates and dumps the whole list in pydantic-core instead of building one model per row
+    adapter = list_adapter(model)
+    return adapter.dump_python(adapter.validate_python(rows), mode="json")
+
+def model_list_json(model, rows: List[dict]) -> bytes:
+    adapter = list_adapter(model)
+    return adapter.dump_json(adapter.validate_python(rows))
+
+def model_list_response(model, rows: List[dict]) -> Response:
+    # Returning a Response skips the second validation pass through response_model
+    return Response(content=model_list_json(model, rows), media_type="application/json")
+
+# Response cache
+class MemoryCacheBackend:
+    name = "memory"
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.tag_keys: Dict[str, set] = {}
+        self.size = 0
+        self.evictions = 0
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+    
+    async def set(self, key: str, value: bytes, tags: List[str], ttl: int):
+        if len(value) > self.max_bytes:
+            return
+        self.remove(key)
+        self.entries[key] = (value, time.monotonic() + ttl, tags)
+        self.size += len(value)
+        for tag in tags:
+            self.tag_keys.setdefault(tag, set()).add(key)
+        # Evict least recently used entries until the cache fits again
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+    
+    async def invalidate(self, tags: List[str]):
+        for tag in tags:
+            for key in list(self.tag_keys.get(tag, ())):
+                self.remove(key)
+    
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry[0])
+        for tag in entry[2]:
+            keys = self.tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_keys[tag]
+    
+    async def stats(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+class RedisCacheBackend:
+    name = "redis"
+    
+    def __init__(self, redis_client, prefix: str = "response-cache:"):
+        self.redis = redis_client
+        self.prefix = prefix
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.redis.get(self.prefix + key)
+    
+    async def set(self, key: str, value: bytes, tags: List[str], ttl: int):
+        # Size-based eviction is left to the server's maxmemory policy
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(self.prefix + key, value, ex=ttl)
+        for tag in tags:
+            pipe.sadd(f"{self.prefix}tag:{tag}", self.prefix + key)
+            pipe.expire(f"{self.prefix}tag:{tag}", ttl)
+        await pipe.execute()
+    
+    async def invalidate(self, tags: List[str]):
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            keys = await self.redis.smembers(tag_key)
+            await self.redis.delete(tag_key, *keys)
+    
+    async def stats(self) -> dict:
+        stats = {"keys": await self.redis.dbsize()}
+        try:
+            info = await self.redis.info("memory")
+        except Exception:
+            # Not every Redis-compatible server (or the fakeredis stand-in) implements INFO
+            return stats
+        return {**stats, "used_memory": info.get("used_memory"), "maxmemory_policy": info.get("maxmemory_policy")}
+
+def create_cache_backend(url: str):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        import redis.asyncio as redis_asyncio
+        return RedisCacheBackend(redis_asyncio.from_url(url))
+    if url.startswith("fakeredis://"):
+        # In-process Redis stand-in for tests and local development
+        import fakeredis
+        return RedisCacheBackend(fakeredis.FakeAsyncRedis())
+    return MemoryCacheBackend(RESPONSE_CACHE_MAX_BYTES)
+
+response_cache = create_cache_backend(RESPONSE_CACHE_URL)
+response_cache_stats: Dict[str, Any] = {"hits": 0, "misses": 0, "errors": 0, "invalidations": 0, "routes": {}}
+
+def cache_query_string(params) -> str:
+    return "&".join(f"{k}={v}" for k, v in sorted(params))
+
+async def cached_response(request: Request, user: dict, tags: List[str], load, versions: Optional[Dict[str, int]] = None):
+    content, hit = await cached_content(
+        request.url.path, cache_query_string(request.query_params.multi_items()), user, tags, load, versions
+    )
+    return Response(content=content, media_type="application/json", headers={"X-Cache": "HIT" if hit else "MISS"})
+
+async def cached_content(path: str, query: str, user: dict, tags: List[str], load, versions: Optional[Dict[str, int]] = None) -> tuple:
+    # The tag versions are shared by every worker and read before the data, so a body built while
+    # another worker writes is stored under the old versions, a key no later request reads
+    if versions is None:
+        versions = await tag_versions(tags)
+    agency = user["id"] if user["role"] == "sub_agency" else "*"
+    version_key = ",".join(f"{tag}.{versions.get(tag, 0)}" for tag in sorted(tags))
+    key = f"{path}:{user['role']}:{agency}:{version_key}:{hashlib.sha1(query.encode('utf-8')).hexdigest()}"
+    route_stats = response_cache_stats["routes"].setdefault(path, {"hits": 0, "misses": 0})
+    
+    try:
+        cached = await response_cache.get(key)
+    except Exception as e:
+        logger.warning(f"Response cache read failed: {e}")
+        response_cache_stats["errors"] += 1
+        cached = None
+    
+    if cached is not None:
+        response_cache_stats["hits"] += 1
+        route_stats["hits"] += 1
+        return cached, True
+    
+    response_cache_stats["misses"] += 1
+    route_stats["misses"] += 1
+    content = await load()
+    if not isinstance(content, bytes):
+        content = orjson.dumps(jsonable_encoder(content))
+    
+    try:
+        await response_cache.set(key, content, tags, RESPONSE_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Response cache write failed: {e}")
+        response_cache_stats["errors"] += 1
+    return content, False
+
+async def invalidate_response_cache(*tags: str):
+    response_cache_stats["invalidations"] += 1
+    # Tags are collection names: bumping their versions moves every worker to new cache keys and ETags
+    try:
+        await bump_collection_versions(tags)
+    except Exception as e:
+        logger.warning(f"Collection version bump failed: {e}")
+    
+    # Entries under the old versions are never read again; dropping them only frees the memory early
+    try:
+        await response_cache.invalidate(list(tags))
+    except Exception as e:
+        logger.warning(f"Response cache invalidation failed: {e}")
+        response_cache_stats["errors"] += 1
+
+# Conditional requests
+async def bump_collection_versions(names):
+    await db.collection_versions.bulk_write(
+        [UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True) for name in names],
+        ordered=False
+    )
+
+async def tag_versions(tags) -> Dict[str, int]:
+    docs = await db.collection_versions.find({"_id": {"$in": list(tags)}}).to_list(length=None)
+    found = {doc["_id"]: doc["version"] for doc in docs}
+    return {tag: found.get(tag, 0) for tag in tags}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison, as proxies may strip or add the W/ prefix
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+async def conditional_response(request: Request, collection: str, build_response):
+    # build_response keys the cached body with the same versions the ETag is built from, so the two cannot
+    # disagree; they are read before the data, so a concurrent write can only make the ETag older than the body
+    versions = await tag_versions([collection])
+    etag = f'W/"{collection}-{versions[collection]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    response = await build_response(versions)
+    response.headers.update(headers)
+    return response
+
+def hit_ratio(hits: int, misses: int) -> Optional[float]:
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(admin: dict = Depends(require_admin)):
+    try:
+        backend_stats = await response_cache.stats()
+    except Exception as e:
+        backend_stats = {"error": str(e)}
+    
+    # Counters are per worker process
+    return {
+        "backend": response_cache.name,
+        "pid": os.getpid(),
+        "hits": response_cache_stats["hits"],
+        "misses": response_cache_stats["misses"],
+        "hit_ratio": hit_ratio(response_cache_stats["hits"], response_cache_stats["misses"]),
+        "errors": response_cache_stats["errors"],
+        "invalidations": response_cache_stats["invalidations"],
+        "routes": {
+            route: {**counts, "hit_ratio": hit_ratio(counts["hits"], counts["misses"])}
+            for route, counts in response_cache_stats["routes"].items()
+        },
+        **backend_stats
+    }
 
 # Auth routes
 @api_router.post("/auth/register", response_model=UserResponse)
@@ -385,6 +1085,7 @@ async def register_user(user_data: UserCreate, admin: dict = Depends(require_adm
     }
     
     await db.users.insert_one(user_dict)
+    await invalidate_response_cache("users")
     
     return UserResponse(
         id=user_dict["id"],
@@ -409,7 +1110,7 @@ async def login(credentials: UserLogin):
     if not user.get("is_active", True):
         raise HTTPException(status_code=403, detail="Account is disabled")
     
-    access_token = create_access_token(data={"sub": user["id"]})
+    tokens = await issue_tokens(user)
     
     user_response = UserResponse(
         id=user["id"],
@@ -425,13 +1126,39 @@ async def login(credentials: UserLogin):
     )
     
     return TokenResponse(
-        access_token=access_token,
+        access_token=tokens["access_token"],
+        refresh_token=tokens["refresh_token"],
+        expires_in=tokens["expires_in"],
         token_type="bearer",
         user=user_response
     )
 
+@api_router.post("/auth/refresh")
+async def refresh_tokens(refresh_data: RefreshRequest):
+    payload = await decode_token(refresh_data.refresh_token, "refresh")
+    
+    # Claim the jti atomically so two requests cannot both exchange the same refresh token
+    claimed = await db.refresh_tokens.find_one_and_update(
+        {"jti": payload["jti"], "user_id": payload["sub"], "used_at": None},
+        {"$set": {"used_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "jti": 1}
+    )
+    if claimed is None:
+        # A rotated token coming back means it was copied: sign the user out everywhere
+        await revoke_user_tokens(payload["sub"])
+        logger.warning(f"Refresh token reuse detected for user {payload['sub']}, tokens revoked")
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    
+    user = await db.users.find_one({"id": payload["sub"]}, {"_id": 0, "password_hash": 0})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=403, detail="Account is disabled")
+    
+    return {**await issue_tokens(user), "token_type": "bearer"}
+
 @api_router.get("/auth/me", response_model=UserResponse)
-async def get_current_user_info(user: dict = Depends(get_current_user)):
+async def get_current_user_info(user: dict = Depends(get_current_user_record)):
     return UserResponse(
         id=user["id"],
         agency_name=user["agency_name"],
@@ -446,7 +1173,7 @@ async def get_current_user_info(user: dict = Depends(get_current_user)):
     )
 
 @api_router.post("/auth/change-password")
-async def change_password(password_data: PasswordChange, user: dict = Depends(get_current_user)):
+async def change_password(password_data: PasswordChange, user: dict = Depends(get_current_user_record)):
     if not verify_password(password_data.old_password, user["password_hash"]):
         raise HTTPException(status_code=400, detail="Incorrect old password")
     
@@ -456,13 +1183,23 @@ async def change_password(password_data: PasswordChange, user: dict = Depends(ge
         {"$set": {"password_hash": new_hash}}
     )
     
-    return {"message": "Password changed successfully"}
+    # Sign out every other session and hand this one fresh tokens
+    await revoke_user_tokens(user["id"])
+    user["token_version"] = user.get("token_version", 0) + 1
+    
+    return {"message": "Password changed successfully", **await issue_tokens(user)}
 
 # User management routes
 @api_router.get("/users", response_model=List[UserResponse])
-async def get_users(admin: dict = Depends(require_admin)):
+async def get_users(request: Request, admin: dict = Depends(require_admin)):
+    return await conditional_response(
+        request, "users",
+        lambda versions: cached_response(request, admin, ["users"], load_users, versions)
+    )
+
+async def load_users() -> bytes:
     users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    return [UserResponse(**user) for user in users]
+    return model_list_json(UserResponse, users)
 
 @api_router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user(user_id: str, admin: dict = Depends(require_admin)):
@@ -480,6 +1217,9 @@ async def update_user(user_id: str, user_data: Dict[str, Any], admin: dict = Dep
         {"id": user_id},
         {"$set": user_data}
     )
+    if TOKEN_CLAIM_FIELDS & user_data.keys():
+        await revoke_user_tokens(user_id)
+    await invalidate_response_cache("users")
     return {"message": "User updated successfully"}
 
 @api_router.delete("/users/{user_id}")
@@ -487,10 +1227,23 @@ async def delete_user(user_id: str, admin: dict = Depends(require_admin)):
     result = await db.users.delete_one({"id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    token_version_cache.pop(user_id, None)
+    await invalidate_response_cache("users")
     return {"message": "User deleted successfully"}
 
 @api_router.post("/users/{user_id}/topup-balance")
-async def topup_balance(user_id: str, topup: BalanceTopUp, admin: dict = Depends(require_admin)):
+async def topup_balance(
+    user_id: str,
+    topup: BalanceTopUp,
+    admin: dict = Depends(require_admin),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    return await run_idempotent(
+        idempotency_key, admin, f"topup-balance:{user_id}", topup,
+        lambda: apply_topup(user_id, topup)
+    )
+
+async def apply_topup(user_id: str, topup: BalanceTopUp) -> dict:
     if topup.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
@@ -508,11 +1261,12 @@ async def topup_balance(user_id: str, topup: BalanceTopUp, admin: dict = Depends
         "amount": topup.amount,
         "type": topup.type,
         "date": datetime.now(timezone.utc).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
     # Store top-up in history
-    await db.topups.insert_one(topup_record)
+    await db.topups.insert_one(with_native_dates("topups", topup_record))
     
     await db.users.update_one(
         {"id": user_id},
@@ -521,6 +1275,7 @@ async def topup_balance(user_id: str, topup: BalanceTopUp, admin: dict = Depends
             "last_balance_topup": topup.amount
         }}
     )
+    await invalidate_response_cache("users")
     
     return {
         "message": "Balance topped up successfully",
@@ -533,7 +1288,7 @@ async def topup_balance(user_id: str, topup: BalanceTopUp, admin: dict = Depends
 @api_router.get("/topups", response_model=List[TopUpResponse])
 async def get_topups(admin: dict = Depends(require_admin)):
     topups = await db.topups.find({}, {"_id": 0}).sort("created_at", -1).to_list(length=None)
-    return [TopUpResponse(**topup) for topup in topups]
+    return model_list_response(TopUpResponse, topups)
 
 @api_router.put("/topups/{topup_id}")
 async def update_topup(topup_id: str, topup_update: TopUpUpdate, admin: dict = Depends(require_admin)):
@@ -559,9 +1314,12 @@ async def update_topup(topup_id: str, topup_update: TopUpUpdate, admin: dict = D
         {"id": topup_id},
         {"$set": {
             "amount": topup_update.amount,
-            "type": topup_update.type
+            "type": topup_update.type,
+            "updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    await invalidate_balance_snapshots(topup["agency_id"], topup.get("date"))
+    await invalidate_response_cache("users")
     
     return {"message": "Top-up updated successfully"}
 
@@ -582,6 +1340,9 @@ async def delete_topup(topup_id: str, admin: dict = Depends(require_admin)):
     
     # Delete top-up record
     await db.topups.delete_one({"id": topup_id})
+    await record_tombstones("topups", [topup])
+    await invalidate_balance_snapshots(topup["agency_id"], topup.get("date"))
+    await invalidate_response_cache("users")
     
     return {"message": "Top-up deleted successfully"}
 
@@ -594,10 +1355,17 @@ async def create_supplier(supplier: SupplierCreate, admin: dict = Depends(requir
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.suppliers.insert_one(supplier_dict)
+    await invalidate_response_cache("suppliers")
     return SupplierResponse(**supplier_dict)
 
 @api_router.get("/suppliers", response_model=List[SupplierResponse])
-async def get_suppliers(user: dict = Depends(get_current_user)):
+async def get_suppliers(request: Request, user: dict = Depends(get_current_user)):
+    return await conditional_response(
+        request, "suppliers",
+        lambda versions: cached_response(request, user, ["suppliers"], load_suppliers, versions)
+    )
+
+async def load_suppliers() -> List[SupplierResponse]:
     suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(1000)
     return [SupplierResponse(**s) for s in suppliers]
 
@@ -606,6 +1374,7 @@ async def delete_supplier(supplier_id: str, admin: dict = Depends(require_admin)
     result = await db.suppliers.delete_one({"id": supplier_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Supplier not found")
+    await invalidate_response_cache("suppliers")
     return {"message": "Supplier deleted successfully"}
 
 # Tourist routes
@@ -615,17 +1384,102 @@ async def create_tourist(tourist: TouristCreate, admin: dict = Depends(require_a
     tourist_dict["id"] = str(uuid.uuid4())
     tourist_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     tourist_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
-    await db.tourists.insert_one(tourist_dict)
+    await db.tourists.insert_one(with_native_dates("tourists", tourist_dict))
+    await invalidate_response_cache("tourists")
     return TouristResponse(**tourist_dict)
 
 @api_router.get("/tourists", response_model=List[TouristResponse])
-async def get_tourists(user: dict = Depends(get_current_user)):
-    tourists = await db.tourists.find({}, {"_id": 0}).to_list(1000)
-    return [TouristResponse(**t) for t in tourists]
+async def get_tourists(request: Request, user: dict = Depends(get_current_user)):
+    async def load():
+        tourists = await db.tourists.find({}, {"_id": 0, "dates": 0}).to_list(1000)
+        return [TouristResponse(**t) for t in tourists]
+    return await conditional_response(
+        request, "tourists",
+        lambda versions: cached_response(request, user, ["tourists"], load, versions)
+    )
+
+def expiring_tourists_pipeline(today: str, cutoff: str, include_expired: bool, agency_id: Optional[str]) -> list:
+    bounds = {"$lte": cutoff} if include_expired else {"$gte": today, "$lte": cutoff}
+    expiry_field = "dates.document_expiration" if native_dates_ready else "document_expiration"
+    expiry = f"${expiry_field}"
+    service = "$dates.date_of_service" if native_dates_ready else "$date_of_service"
+    
+    # Upcoming reservations are narrowed with an indexed match before anything is compared per tourist
+    upcoming = date_range_query("date_of_service", {"$gte": today})
+    if agency_id:
+        upcoming["agency_id"] = agency_id
+    
+    # A tourist is linked to a reservation by name, split on commas the same way the tourist-name autocomplete reads them
+    names = {"$map": {
+        "input": {"$split": [{"$toLower": {"$ifNull": ["$tourist_names", ""]}}, ","]},
+        "as": "token",
+        "in": {"$trim": {"input": "$$token"}}
+    }}
+    travels = [
+        {"$match": upcoming},
+        {"$match": {"$expr": {"$and": [
+            {"$gt": [service, "$$expiry"]},
+            {"$in": ["$$name", names]}
+        ]}}},
+        {"$sort": {"date_of_service": 1}},
+        {"$project": {
+            "_id": 0,
+            "reservation_id": "$id",
+            "agency_id": 1,
+            "agency_name": 1,
+            "service_type": 1,
+            "date_of_service": 1
+        }}
+    ]
+    
+    return [
+        {"$match": {"$and": [
+            date_range_query("document_expiration", bounds),
+            {"document_expiration": {"$nin": [None, ""]}}
+        ]}},
+        {"$sort": {expiry_field: 1, "id": 1}},
+        {"$lookup": {
+            "from": "reservations",
+            "let": {
+                "expiry": expiry,
+                "name": {"$trim": {"input": {"$toLower": {"$concat": [
+                    {"$ifNull": ["$first_name", ""]}, " ", {"$ifNull": ["$last_name", ""]}
+                ]}}}}
+            },
+            "pipeline": travels,
+            "as": "travels_after_expiry"
+        }},
+        {"$project": {"_id": 0, "dates": 0}}
+    ]
+
+@api_router.get("/tourists/expiring", response_model=List[ExpiringTouristResponse])
+async def get_expiring_tourists(
+    within_days: int = Query(90, ge=0, le=3650),
+    include_expired: bool = False,
+    travelling_only: bool = False,
+    user: dict = Depends(get_current_user)
+):
+    today = datetime.now(timezone.utc).date()
+    cutoff = today + timedelta(days=within_days)
+    agency_id = user["id"] if user["role"] == "sub_agency" else None
+    
+    pipeline = expiring_tourists_pipeline(today.isoformat(), cutoff.isoformat(), include_expired, agency_id)
+    if travelling_only:
+        pipeline.append({"$match": {"travels_after_expiry.0": {"$exists": True}}})
+    tourists = await db.tourists.aggregate(pipeline).to_list(1000)
+    
+    expiring = []
+    for tourist in tourists:
+        # Before the native dates are ready the match compares strings, which lets malformed values through
+        expiration = parse_stored_date(tourist["document_expiration"])
+        if expiration:
+            tourist["days_left"] = (expiration.date() - today).days
+            expiring.append(tourist)
+    return model_list_response(ExpiringTouristResponse, expiring)
 
 @api_router.get("/tourists/{tourist_id}", response_model=TouristResponse)
 async def get_tourist(tourist_id: str, user: dict = Depends(get_current_user)):
-    tourist = await db.tourists.find_one({"id": tourist_id}, {"_id": 0})
+    tourist = await db.tourists.find_one({"id": tourist_id}, {"_id": 0, "dates": 0})
     if not tourist:
         raise HTTPException(status_code=404, detail="Tourist not found")
     return TouristResponse(**tourist)
@@ -635,15 +1489,17 @@ async def update_tourist(tourist_id: str, tourist_data: TouristUpdate, admin: di
     update_dict = {k: v for k, v in tourist_data.model_dump().items() if v is not None}
     update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    result = await db.tourists.update_one(
+    tourist = await db.tourists.find_one_and_update(
         {"id": tourist_id},
-        {"$set": update_dict}
+        {"$set": {**update_dict, **native_date_updates("tourists", update_dict)}},
+        projection={"_id": 0, "dates": 0},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.matched_count == 0:
+    if not tourist:
         raise HTTPException(status_code=404, detail="Tourist not found")
+    await invalidate_response_cache("tourists")
     
-    tourist = await db.tourists.find_one({"id": tourist_id}, {"_id": 0})
     return TouristResponse(**tourist)
 
 @api_router.delete("/tourists/{tourist_id}")
@@ -651,11 +1507,11 @@ async def delete_tourist(tourist_id: str, admin: dict = Depends(require_admin)):
     result = await db.tourists.delete_one({"id": tourist_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Tourist not found")
+    await invalidate_response_cache("tourists")
     return {"message": "Tourist deleted successfully"}
 
 # Reservation routes
-@api_router.post("/reservations", response_model=ReservationResponse)
-async def create_reservation(reservation: ReservationCreate, admin: dict = Depends(require_admin)):
+def build_reservation_document(reservation: ReservationCreate) -> dict:
     reservation_dict = reservation.model_dump()
     reservation_dict["id"] = str(uuid.uuid4())
     reservation_dict["created_at"] = datetime.now(timezone.utc).isoformat()
@@ -666,6 +1522,22 @@ async def create_reservation(reservation: ReservationCreate, admin: dict = Depen
         if not reservation_dict.get("actual_date_of_prepayment"):
             reservation_dict["actual_date_of_prepayment"] = reservation_dict["date_of_issue"]
     
+    return with_native_dates("reservations", reservation_dict)
+
+@api_router.post("/reservations", response_model=ReservationResponse)
+async def create_reservation(
+    reservation: ReservationCreate,
+    admin: dict = Depends(require_admin),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    return await run_idempotent(
+        idempotency_key, admin, "create-reservation", reservation,
+        lambda: insert_reservation(reservation)
+    )
+
+async def insert_reservation(reservation: ReservationCreate) -> ReservationResponse:
+    reservation_dict = build_reservation_document(reservation)
+    
     await db.reservations.insert_one(reservation_dict)
     
     # Deduct reservation price from agency balance
@@ -678,23 +1550,181 @@ async def create_reservation(reservation: ReservationCreate, admin: dict = Depen
                 {"$set": {"balance": new_balance}}
             )
     
+    # Invalidate only after every write, or a read in between caches the old balance under the new ETag
+    invalidate_reservation_counts()
+    await invalidate_response_cache("reservations", "users")
+    await invalidate_balance_snapshots(reservation_dict.get("agency_id"), reservation_dict.get("date_of_issue"))
+    
     return ReservationResponse(**reservation_dict)
 
-@api_router.get("/reservations")
-async def get_reservations(
-    user: dict = Depends(get_current_user),
+def normalize_import_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str):
+        value = value.strip()
+    return value
+
+def parse_import_rows(filename: str, content: bytes) -> List[dict]:
+    extension = Path(filename or "").suffix.lower()
+
+    try:
+        if extension == ".json":
+            data = json.loads(content.decode("utf-8-sig"))
+            if isinstance(data, dict):
+                data = data.get("reservations", [])
+            if not isinstance(data, list):
+                raise ValueError("Expected a list of reservations")
+            rows = [row if isinstance(row, dict) else {} for row in data]
+        elif extension == ".csv":
+            reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+            rows = [dict(row) for row in reader]
+        elif extension == ".xlsx":
+            from openpyxl import load_workbook
+            workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+            sheet_rows = workbook.active.iter_rows(values_only=True)
+            headers = [str(h).strip() if h is not None else "" for h in next(sheet_rows, [])]
+            rows = [
+                dict(zip(headers, values))
+                for values in sheet_rows
+                if any(v is not None and v != "" for v in values)
+            ]
+            workbook.close()
+        else:
+            raise HTTPException(status_code=400, detail="Unsupported file type, expected .csv, .xlsx or .json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse file: {e}")
+
+    # Drop empty cells so model defaults apply
+    cleaned_rows = []
+    for row in rows:
+        cleaned = {}
+        for key, value in row.items():
+            value = normalize_import_value(value)
+            if key and value is not None and value != "":
+                cleaned[key] = value
+        cleaned_rows.append(cleaned)
+    return cleaned_rows
+
+@api_router.post("/reservations/bulk")
+async def bulk_import_reservations(file: UploadFile = File(...), admin: dict = Depends(require_admin)):
+    rows = parse_import_rows(file.filename, await file.read())
+    if len(rows) > BULK_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Too many rows, maximum is {BULK_IMPORT_MAX_ROWS}")
+
+    errors = []
+    documents = []
+    row_numbers = []
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            reservation = ReservationCreate(**row)
+        except ValidationError as e:
+            errors.append({
+                "row": row_number,
+                "errors": [
+                    {"field": ".".join(str(loc) for loc in err["loc"]), "message": err["msg"]}
+                    for err in e.errors()
+                ]
+            })
+            continue
+        documents.append(build_reservation_document(reservation))
+        row_numbers.append(row_number)
+
+    inserted = 0
+    balance_deltas: Dict[str, float] = {}
+    earliest_issue_dates: Dict[str, str] = {}
+    for start in range(0, len(documents), BULK_IMPORT_BATCH_SIZE):
+        batch = documents[start:start + BULK_IMPORT_BATCH_SIZE]
+        failed_indexes = set()
+        try:
+            await db.reservations.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed_indexes.add(write_error["index"])
+                errors.append({
+                    "row": row_numbers[start + write_error["index"]],
+                    "errors": [{"field": None, "message": write_error.get("errmsg", "Write failed")}]
+                })
+
+        for index, reservation_dict in enumerate(batch):
+            if index in failed_indexes:
+                continue
+            inserted += 1
+            if reservation_dict.get("agency_id") and reservation_dict.get("price"):
+                agency_id = reservation_dict["agency_id"]
+                balance_deltas[agency_id] = balance_deltas.get(agency_id, 0.0) - reservation_dict["price"]
+                issue_date = reservation_dict["date_of_issue"]
+                earliest_issue_dates[agency_id] = min(earliest_issue_dates.get(agency_id, issue_date), issue_date)
+
+    # Deduct reservation prices from agency balances, one $inc per agency
+    if balance_deltas:
+        await db.users.bulk_write(
+            [UpdateOne({"id": agency_id}, {"$inc": {"balance": delta}}) for agency_id, delta in balance_deltas.items()],
+            ordered=False
+        )
+
+    if inserted:
+        invalidate_reservation_counts()
+        await invalidate_response_cache("reservations", "users")
+    for agency_id, issue_date in earliest_issue_dates.items():
+        await invalidate_balance_snapshots(agency_id, issue_date)
+    
+    errors.sort(key=lambda e: e["row"])
+    return {
+        "message": "Reservations imported",
+        "total_rows": len(rows),
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": errors
+    }
+
+def reservation_projection(user: dict, fields: Optional[List[str]] = None) -> dict:
+    hidden_fields = RESERVATION_ADMIN_ONLY_FIELDS if user["role"] == "sub_agency" else []
+    
+    projection = {"_id": 0}
+    if fields is None:
+        projection["dates"] = 0
+        for field in hidden_fields:
+            projection[field] = 0
+    else:
+        for field in fields:
+            if field not in hidden_fields:
+                projection[field] = 1
+    return projection
+
+def parse_reservation_fields(fields: Optional[str], view: Optional[str]) -> Optional[List[str]]:
+    if fields:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in RESERVATION_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        if "id" not in selected:
+            selected.insert(0, "id")
+        return selected
+    
+    if view is None or view == "full":
+        return None
+    if view not in RESERVATION_VIEWS:
+        raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+    return list(RESERVATION_VIEWS[view])
+
+def build_reservation_query(
+    user: dict,
     search: Optional[str] = None,
     service_type: Optional[str] = None,
-    payment_status: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    page: int = 1,
-    limit: int = 25
-):
+    agency_id: Optional[str] = None
+) -> dict:
     query = {}
     
     if user["role"] == "sub_agency":
         query["agency_id"] = user["id"]
+    elif agency_id:
+        query["agency_id"] = agency_id
     
     if search:
         query["$or"] = [
@@ -712,22 +1742,93 @@ async def get_reservations(
             date_query["$gte"] = date_from
         if date_to:
             date_query["$lte"] = date_to
-        query["date_of_service"] = date_query
+        query.update(date_range_query("date_of_service", date_query))
     
-    total = await db.reservations.count_documents(query)
+    return query
+
+@api_router.get("/reservations")
+async def get_reservations(
+    user: dict = Depends(get_current_user),
+    search: Optional[str] = None,
+    service_type: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    page: int = 1,
+    limit: int = 25,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    facets: Optional[str] = None,
+    count: str = "exact",
+    include_archived: bool = False
+):
+    if count not in RESERVATION_COUNT_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Unknown count strategy: {count}")
+    
+    query = build_reservation_query(user, search, service_type, date_from, date_to)
+    
+    facet_names = []
+    if facets:
+        facet_names = [f.strip() for f in facets.split(",") if f.strip()]
+        unknown = [f for f in facet_names if f not in RESERVATION_FACETS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown facets: {', '.join(unknown)}")
+    
+    selected_fields = parse_reservation_fields(fields, view)
+    
+    # Payment status filtering needs these fields even when not selected
+    extra_fields = []
+    if selected_fields is not None and payment_status:
+        extra_fields = [f for f in PAYMENT_STATUS_FIELDS if f not in selected_fields]
+        selected_fields = selected_fields + extra_fields
     
     skip = (page - 1) * limit
     
-    projection = {"_id": 0}
-    if user["role"] == "sub_agency":
-        projection["supplier_id"] = 0
-        projection["supplier_name"] = 0
-        projection["supplier_price"] = 0
-        projection["supplier_prepayment_amount"] = 0
-        projection["revenue"] = 0
-        projection["revenue_percentage"] = 0
+    projection = reservation_projection(user, selected_fields)
+    
+    facet_counts = None
+    if facet_names or include_archived:
+        # Page, facet counts and (for an exact count) the total in a single aggregation
+        archive = "reservations_archive" if include_archived else None
+        page_limit = limit + 1 if count == "has_more" else limit
+        facet_stages = {"page": [{"$skip": skip}, {"$limit": page_limit}, {"$project": projection}]}
+        if count == "exact":
+            facet_stages["total"] = [{"$count": "count"}]
+        for name in facet_names:
+            facet_stages[name] = build_reservation_facet(name)
+        
+        pipeline = match_with_archive(query, archive)
+        aggregate_task = db.reservations.aggregate(pipeline + [{"$facet": facet_stages}]).to_list(1)
+        if count == "cached":
+            total, result = await asyncio.gather(cached_reservation_count(user, query, archive), aggregate_task)
+        else:
+            result = await aggregate_task
+        result = result[0] if result else {}
+        reservations = result.get("page", [])
+        if count == "exact":
+            total = result["total"][0]["count"] if result.get("total") else 0
+        elif count == "has_more":
+            has_more = len(reservations) > limit
+            reservations = reservations[:limit]
+            total = None
+        if facet_names:
+            facet_counts = {name: format_facet_buckets(name, result.get(name, [])) for name in facet_names}
+    elif count == "has_more":
+        # Fetch one extra row instead of counting
+        reservations = await db.reservations.find(query, projection).skip(skip).limit(limit + 1).to_list(limit + 1)
+        has_more = len(reservations) > limit
+        reservations = reservations[:limit]
+        total = None
+    else:
+        cursor = db.reservations.find(query, projection).skip(skip).limit(limit)
+        if count == "cached":
+            count_task = cached_reservation_count(user, query)
+        else:
+            count_task = db.reservations.count_documents(query)
+        total, reservations = await asyncio.gather(count_task, cursor.to_list(limit))
     
-    reservations = await db.reservations.find(query, projection).skip(skip).limit(limit).to_list(limit)
+    if total is not None:
+        has_more = skip + len(reservations) < total
     
     if payment_status:
         filtered_reservations = []
@@ -745,59 +1846,131 @@ async def get_reservations(
                 filtered_reservations.append(res)
         reservations = filtered_reservations
     
-    return {
+    if extra_fields:
+        for res in reservations:
+            for field in extra_fields:
+                res.pop(field, None)
+    
+    response = {
         "reservations": reservations,
         "total": total,
         "page": page,
         "limit": limit,
-        "pages": (total + limit - 1) // limit
+        "pages": (total + limit - 1) // limit if total is not None else None,
+        "has_more": has_more
     }
+    if facet_counts is not None:
+        response["facets"] = facet_counts
+    return response
+
+def match_with_archive(query: dict, archive: Optional[str]) -> list:
+    # The archive collection is only read when a caller asks for it
+    pipeline = [{"$match": query}]
+    if archive:
+        pipeline.append({"$unionWith": {"coll": archive, "pipeline": [{"$match": query}]}})
+    return pipeline
+
+reservation_count_cache: Dict[str, tuple] = {}
+
+async def cached_reservation_count(user: dict, query: dict, archive: Optional[str] = None) -> int:
+    query_hash = hashlib.sha1(json.dumps(query, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    key = f"{user['id']}:{archive or ''}:{query_hash}"
+    now = time.monotonic()
+    
+    cached = reservation_count_cache.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+    
+    total = await db.reservations.count_documents(query)
+    if archive:
+        total += await db[archive].count_documents(query)
+    
+    if len(reservation_count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+        for stale_key in [k for k, v in reservation_count_cache.items() if v[1] <= now]:
+            del reservation_count_cache[stale_key]
+        if len(reservation_count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+            reservation_count_cache.clear()
+    reservation_count_cache[key] = (total, now + COUNT_CACHE_TTL_SECONDS)
+    return total
+
+def invalidate_reservation_counts():
+    reservation_count_cache.clear()
+
+def payment_status_expression() -> dict:
+    # Aggregation equivalent of compute_payment_status
+    rest = {"$ifNull": ["$rest_amount_of_payment", 0]}
+    prepayment = {"$ifNull": ["$prepayment_amount", 0]}
+    last_date = "$dates.last_date_of_payment" if native_dates_ready else {"$dateFromString": {
+        "dateString": "$last_date_of_payment",
+        "onError": None,
+        "onNull": None
+    }}
+    is_overdue = {"$and": [{"$ne": [last_date, None]}, {"$lt": [last_date, "$$NOW"]}]}
+    is_upcoming = {"$and": [
+        {"$ne": [last_date, None]},
+        {"$lt": [{"$subtract": [last_date, "$$NOW"]}, 8 * 24 * 60 * 60 * 1000]}
+    ]}
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": [rest, 0]}, "then": "paid"},
+            {"case": {"$and": [{"$gt": [prepayment, 0]}, {"$gt": [rest, 0]}, is_overdue]}, "then": "overdue"},
+            {"case": {"$and": [{"$gt": [prepayment, 0]}, {"$gt": [rest, 0]}, is_upcoming]}, "then": "upcoming"},
+            {"case": {"$and": [{"$gt": [prepayment, 0]}, {"$gt": [rest, 0]}]}, "then": "prepaid"},
+            {"case": {"$and": [{"$gt": [rest, 0]}, is_overdue]}, "then": "overdue"}
+        ],
+        "default": "unpaid"
+    }}
+
+def build_reservation_facet(name: str) -> list:
+    if name == "service_type":
+        group_key = "$service_type"
+    elif name == "payment_status":
+        group_key = payment_status_expression()
+    else:
+        group_key = {"id": "$agency_id", "name": "$agency_name"}
+    return [
+        {"$group": {"_id": group_key, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}}
+    ]
+
+def format_facet_buckets(name: str, buckets: List[dict]) -> List[dict]:
+    if name == "agency":
+        return [
+            {"value": b["_id"].get("id"), "agency_name": b["_id"].get("name"), "count": b["count"]}
+            for b in buckets
+        ]
+    return [{"value": b["_id"], "count": b["count"]} for b in buckets]
 
 def compute_payment_status(reservation: dict) -> str:
-    rest = reservation.get("rest_amount_of_payment", 0)
-    prepayment = reservation.get("prepayment_amount", 0)
-    last_date = reservation.get("last_date_of_payment")
+    rest = reservation.get("rest_amount_of_payment") or 0
+    prepayment = reservation.get("prepayment_amount") or 0
+    # Parsed like the native dates, so date-only values count from midnight UTC as in payment_status_expression
+    last_date_obj = parse_stored_date(reservation.get("last_date_of_payment"))
+    today = datetime.now(timezone.utc)
     
     if rest == 0:
         return "paid"
     elif prepayment > 0 and rest > 0:
-        if last_date:
-            try:
-                last_date_obj = datetime.fromisoformat(last_date.replace("Z", "+00:00"))
-                today = datetime.now(timezone.utc)
-                if today > last_date_obj:
-                    return "overdue"
-                else:
-                    days_diff = (last_date_obj - today).days
-                    if days_diff <= 7:
-                        return "upcoming"
-            except:
-                pass
+        if last_date_obj:
+            if today > last_date_obj:
+                return "overdue"
+            days_diff = (last_date_obj - today).days
+            if days_diff <= 7:
+                return "upcoming"
         return "prepaid"
     elif rest > 0:
-        if last_date:
-            try:
-                last_date_obj = datetime.fromisoformat(last_date.replace("Z", "+00:00"))
-                today = datetime.now(timezone.utc)
-                if today > last_date_obj:
-                    return "overdue"
-            except:
-                pass
+        if last_date_obj and today > last_date_obj:
+            return "overdue"
         return "unpaid"
     return "unpaid"
 
 @api_router.get("/reservations/{reservation_id}")
 async def get_reservation(reservation_id: str, user: dict = Depends(get_current_user)):
-    projection = {"_id": 0}
-    if user["role"] == "sub_agency":
-        projection["supplier_id"] = 0
-        projection["supplier_name"] = 0
-        projection["supplier_price"] = 0
-        projection["supplier_prepayment_amount"] = 0
-        projection["revenue"] = 0
-        projection["revenue_percentage"] = 0
+    projection = reservation_projection(user)
     
     reservation = await db.reservations.find_one({"id": reservation_id}, projection)
+    if not reservation:
+        reservation = await db.reservations_archive.find_one({"id": reservation_id}, projection)
     
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
@@ -813,66 +1986,127 @@ async def update_reservation(
     reservation_data: ReservationUpdate,
     admin: dict = Depends(require_admin)
 ):
-    # Get old reservation to check if price changed
-    old_reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
-    if not old_reservation:
-        raise HTTPException(status_code=404, detail="Reservation not found")
-    
     update_dict = {k: v for k, v in reservation_data.model_dump().items() if v is not None}
     update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
     
+    # Update and get the previous price in one round trip
+    old_reservation = await db.reservations.find_one_and_update(
+        {"id": reservation_id},
+        {"$set": {**update_dict, **native_date_updates("reservations", update_dict)}},
+        projection={"_id": 0, "agency_id": 1, "price": 1, "date_of_issue": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not old_reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    
     # If price changed, adjust agency balance
     if "price" in update_dict and old_reservation.get("agency_id"):
-        old_price = old_reservation.get("price", 0)
-        new_price = update_dict["price"]
-        price_diff = new_price - old_price
-        
-        agency = await db.users.find_one({"id": old_reservation["agency_id"]}, {"_id": 0})
-        if agency:
-            new_balance = agency.get("balance", 0.0) - price_diff
+        price_diff = update_dict["price"] - old_reservation.get("price", 0)
+        if price_diff:
             await db.users.update_one(
                 {"id": old_reservation["agency_id"]},
-                {"$set": {"balance": new_balance}}
+                {"$inc": {"balance": -price_diff}}
             )
     
-    result = await db.reservations.update_one(
-        {"id": reservation_id},
-        {"$set": update_dict}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Reservation not found")
+    invalidate_reservation_counts()
+    await invalidate_response_cache("reservations", "users")
+    if "price" in update_dict or "date_of_issue" in update_dict:
+        issue_dates = [d for d in (old_reservation.get("date_of_issue"), update_dict.get("date_of_issue")) if d]
+        await invalidate_balance_snapshots(old_reservation.get("agency_id"), min(issue_dates, default=None))
     
     return {"message": "Reservation updated successfully"}
 
-@api_router.post("/reservations/{reservation_id}/mark-paid")
-async def mark_reservation_paid(reservation_id: str, admin: dict = Depends(require_admin)):
-    reservation = await db.reservations.find_one({"id": reservation_id})
-    if not reservation:
-        raise HTTPException(status_code=404, detail="Reservation not found")
-    
-    today = datetime.now(timezone.utc).isoformat()
+def bulk_filter_fields(bulk_filter: Optional[BaseModel]) -> Optional[dict]:
+    if bulk_filter is None:
+        return None
+    # An empty filter would select every document, so at least one field has to narrow it
+    fields = {k: v for k, v in bulk_filter.model_dump().items() if v not in (None, "")}
+    if not fields:
+        raise HTTPException(status_code=400, detail="Filter must set at least one field")
+    return fields
+
+async def resolve_bulk_targets(collection, ids: Optional[List[str]], query: Optional[dict], fields: tuple = ()):
+    # Returns the requested ids in order and the found documents by id
+    projection = {"_id": 0, "id": 1, **{field: 1 for field in fields}}
+    if ids:
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > BULK_UPDATE_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Too many ids, maximum is {BULK_UPDATE_MAX_ITEMS}")
+        found = await collection.find({"id": {"$in": ids}}, projection).to_list(length=None)
+        return ids, {doc["id"]: doc for doc in found}
     
-    # Add rest amount to prepayment amount to make total = price
-    current_prepayment = reservation.get("prepayment_amount", 0)
-    rest_amount = reservation.get("rest_amount_of_payment", 0)
-    new_prepayment = current_prepayment + rest_amount
+    if query is None:
+        raise HTTPException(status_code=400, detail="Provide ids or filter")
     
-    update_data = {
+    found = await collection.find(query, projection).limit(BULK_UPDATE_MAX_ITEMS + 1).to_list(length=None)
+    if len(found) > BULK_UPDATE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Filter matches more than {BULK_UPDATE_MAX_ITEMS} documents")
+    return [doc["id"] for doc in found], {doc["id"]: doc for doc in found}
+
+def build_mark_paid_update(today: str) -> list:
+    # Pipeline update: every field in the $set stage reads the pre-update values
+    return [{"$set": {
         "actual_date_of_full_payment": today,
-        "prepayment_amount": new_prepayment,
+        "prepayment_amount": {"$add": [
+            {"$ifNull": ["$prepayment_amount", 0]},
+            {"$ifNull": ["$rest_amount_of_payment", 0]}
+        ]},
         "rest_amount_of_payment": 0,
+        "actual_date_of_prepayment": {"$cond": [
+            {"$gt": [{"$ifNull": ["$actual_date_of_prepayment", ""]}, ""]},
+            "$actual_date_of_prepayment",
+            {"$ifNull": ["$date_of_issue", today]}
+        ]},
         "updated_at": today
-    }
+    }}]
+
+@api_router.post("/reservations/bulk-mark-paid")
+async def bulk_mark_reservations_paid(data: ReservationBulkMarkPaid, admin: dict = Depends(require_admin)):
+    query = None
+    filter_fields = bulk_filter_fields(data.filter)
+    if filter_fields is not None:
+        query = {**build_reservation_query(admin, **filter_fields), "rest_amount_of_payment": {"$gt": 0}}
     
-    # Set actual_date_of_prepayment if not set
-    if not reservation.get("actual_date_of_prepayment"):
-        update_data["actual_date_of_prepayment"] = reservation.get("date_of_issue", today)
+    ids, found = await resolve_bulk_targets(db.reservations, data.ids, query, ("rest_amount_of_payment",))
     
-    await db.reservations.update_one(
+    # Reservations that are already paid keep their original actual_date_of_full_payment
+    def target_status(rid: str) -> str:
+        if rid not in found:
+            return "not_found"
+        return "updated" if (found[rid].get("rest_amount_of_payment") or 0) > 0 else "already_paid"
+    
+    results = [{"id": rid, "status": target_status(rid)} for rid in ids]
+    today = datetime.now(timezone.utc).isoformat()
+    operations = [
+        UpdateOne({"id": result["id"], "rest_amount_of_payment": {"$gt": 0}}, build_mark_paid_update(today))
+        for result in results if result["status"] == "updated"
+    ]
+    if operations:
+        await db.reservations.bulk_write(operations, ordered=False)
+        invalidate_reservation_counts()
+        await invalidate_response_cache("reservations")
+    
+    return {
+        "message": "Reservations marked as paid",
+        "updated": len(operations),
+        "skipped": sum(1 for result in results if result["status"] == "already_paid"),
+        "not_found": sum(1 for result in results if result["status"] == "not_found"),
+        "results": results
+    }
+
+@api_router.post("/reservations/{reservation_id}/mark-paid")
+async def mark_reservation_paid(reservation_id: str, admin: dict = Depends(require_admin)):
+    today = datetime.now(timezone.utc).isoformat()
+    
+    # Add rest amount to prepayment amount to make total = price
+    result = await db.reservations.update_one(
         {"id": reservation_id},
-        {"$set": update_data}
+        build_mark_paid_update(today)
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    invalidate_reservation_counts()
+    await invalidate_response_cache("reservations")
     
     return {"message": "Reservation marked as paid"}
 
@@ -894,11 +2128,21 @@ async def delete_reservation(reservation_id: str, admin: dict = Depends(require_
             )
     
     result = await db.reservations.delete_one({"id": reservation_id})
+    await record_tombstones("reservations", [reservation])
+    invalidate_reservation_counts()
+    await invalidate_response_cache("reservations", "users")
+    await invalidate_balance_snapshots(reservation.get("agency_id"), reservation.get("date_of_issue"))
     return {"message": "Reservation deleted successfully"}
 
 # Settings routes
 @api_router.get("/settings", response_model=SettingsResponse)
-async def get_settings(user: dict = Depends(get_current_user)):
+async def get_settings(request: Request, user: dict = Depends(get_current_user)):
+    return await conditional_response(
+        request, "settings",
+        lambda versions: cached_response(request, user, ["settings"], load_settings, versions)
+    )
+
+async def load_settings() -> SettingsResponse:
     settings = await db.settings.find_one({"id": "default"}, {"_id": 0})
     if not settings:
         return SettingsResponse(upcoming_due_threshold_days=7)
@@ -911,39 +2155,50 @@ async def update_settings(settings_data: SettingsUpdate, admin: dict = Depends(r
         {"$set": settings_data.model_dump()},
         upsert=True
     )
+    await invalidate_response_cache("settings")
     return {"message": "Settings updated successfully"}
 
 # Statistics route
 @api_router.get("/statistics")
-async def get_statistics(user: dict = Depends(get_current_user)):
+async def get_statistics(request: Request, user: dict = Depends(get_current_user)):
+    return await cached_response(request, user, ["reservations"], lambda: load_statistics(user))
+
+async def load_statistics(user: dict) -> dict:
     query = {}
     if user["role"] == "sub_agency":
         query["agency_id"] = user["id"]
     
-    projection = {"_id": 0}
-    if user["role"] == "sub_agency":
-        projection["supplier_id"] = 0
-        projection["supplier_name"] = 0
-        projection["supplier_price"] = 0
-        projection["supplier_prepayment_amount"] = 0
-        projection["revenue"] = 0
-        projection["revenue_percentage"] = 0
+    projection = reservation_projection(user)
     
     reservations = await db.reservations.find(query, projection).to_list(10000)
     
-    total_price = sum(r.get("price", 0) for r in reservations)
-    total_prepayment = sum(r.get("prepayment_amount", 0) for r in reservations)
-    total_rest = sum(r.get("rest_amount_of_payment", 0) for r in reservations)
+    # Archived reservations still count towards the totals, summed in the database
+    archived = await db.reservations_archive.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": 1},
+            "price": {"$sum": "$price"},
+            "prepayment_amount": {"$sum": "$prepayment_amount"},
+            "rest_amount_of_payment": {"$sum": "$rest_amount_of_payment"},
+            "revenue": {"$sum": "$revenue"}
+        }}
+    ]).to_list(1)
+    archived = archived[0] if archived else {}
+    
+    total_price = sum(r.get("price", 0) for r in reservations) + archived.get("price", 0)
+    total_prepayment = sum(r.get("prepayment_amount", 0) for r in reservations) + archived.get("prepayment_amount", 0)
+    total_rest = sum(r.get("rest_amount_of_payment", 0) for r in reservations) + archived.get("rest_amount_of_payment", 0)
     
     stats = {
-        "total_reservations": len(reservations),
+        "total_reservations": len(reservations) + archived.get("count", 0),
         "total_price": round(total_price, 2),
         "total_prepayment": round(total_prepayment, 2),
         "total_rest": round(total_rest, 2)
     }
     
     if user["role"] == "admin":
-        total_revenue = sum(r.get("revenue", 0) for r in reservations)
+        total_revenue = sum(r.get("revenue", 0) for r in reservations) + archived.get("revenue", 0)
         stats["total_revenue"] = round(total_revenue, 2)
     
     return stats
@@ -951,6 +2206,9 @@ async def get_statistics(user: dict = Depends(get_current_user)):
 # Get unique tourist names for autocomplete
 @api_router.get("/tourist-names")
 async def get_tourist_names(user: dict = Depends(get_current_user)):
+    return await load_tourist_names()
+
+async def load_tourist_names() -> dict:
     # Get distinct tourist names from reservations
     reservations = await db.reservations.find({}, {"_id": 0, "tourist_names": 1}).to_list(10000)
     names_set = set()
@@ -964,9 +2222,84 @@ async def get_tourist_names(user: dict = Depends(get_current_user)):
                     names_set.add(name)
     return {"names": sorted(list(names_set))}
 
+# Dashboard bootstrap
+# Section name -> (cache path shared with the standalone endpoint, tags, admin only)
+BOOTSTRAP_SECTIONS = {
+    "settings": ("/api/settings", ["settings"], False),
+    "statistics": ("/api/statistics", ["reservations"], False),
+    "expenses_total": ("/api/expenses/total", ["expenses"], False),
+    "reservations": ("/api/bootstrap/reservations", ["reservations"], False),
+    "users": ("/api/users", ["users"], True),
+    "suppliers": ("/api/suppliers", ["suppliers"], True),
+    "tourist_names": ("/api/tourist-names", ["reservations"], True)
+}
+
+@api_router.get("/bootstrap")
+async def get_bootstrap(
+    user: dict = Depends(get_current_user),
+    sections: Optional[str] = None,
+    search: Optional[str] = None,
+    service_type: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    page: int = 1,
+    limit: int = 25
+):
+    if sections:
+        names = [name.strip() for name in sections.split(",") if name.strip()]
+        unknown = [name for name in names if name not in BOOTSTRAP_SECTIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+        if user["role"] != "admin" and any(BOOTSTRAP_SECTIONS[name][2] for name in names):
+            raise HTTPException(status_code=403, detail="Admin access required")
+    else:
+        names = [name for name, (_, _, admin_only) in BOOTSTRAP_SECTIONS.items() if user["role"] == "admin" or not admin_only]
+    
+    # The Dashboard table only needs the list view
+    reservation_params = {
+        "search": search,
+        "service_type": service_type,
+        "payment_status": payment_status,
+        "page": page,
+        "limit": limit,
+        "view": "list"
+    }
+    loaders = {
+        "settings": load_settings,
+        "statistics": lambda: load_statistics(user),
+        "expenses_total": lambda: load_expenses_total(user),
+        "reservations": lambda: get_reservations(user, **reservation_params),
+        "users": load_users,
+        "suppliers": load_suppliers,
+        "tourist_names": load_tourist_names
+    }
+    
+    # One read for the versions of every section's tags
+    versions = await tag_versions({tag for name in names for tag in BOOTSTRAP_SECTIONS[name][1]})
+    
+    async def load_section(name: str) -> bytes:
+        path, tags, _ = BOOTSTRAP_SECTIONS[name]
+        query = cache_query_string(reservation_params.items()) if name == "reservations" else ""
+        content, _ = await cached_content(path, query, user, tags, loaders[name], versions)
+        return content
+    
+    # Sections are already serialized, so the payload is stitched together without re-encoding
+    contents = await asyncio.gather(*(load_section(name) for name in names))
+    payload = b",".join(orjson.dumps(name) + b":" + content for name, content in zip(names, contents))
+    return Response(content=b"{" + payload + b"}", media_type="application/json")
+
 # Expense Endpoints
 @api_router.post("/expenses", response_model=ExpenseResponse)
-async def create_expense(expense: ExpenseCreate, admin: dict = Depends(require_admin)):
+async def create_expense(
+    expense: ExpenseCreate,
+    admin: dict = Depends(require_admin),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    return await run_idempotent(
+        idempotency_key, admin, "create-expense", expense,
+        lambda: insert_expense(expense)
+    )
+
+async def insert_expense(expense: ExpenseCreate) -> ExpenseResponse:
     # Get agency name
     agency = await db.users.find_one({"id": expense.agency_id}, {"_id": 0})
     if not agency:
@@ -979,10 +2312,12 @@ async def create_expense(expense: ExpenseCreate, admin: dict = Depends(require_a
         "amount": expense.amount,
         "date": expense.date,
         "description": expense.description,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.expenses.insert_one(expense_dict)
+    await db.expenses.insert_one(with_native_dates("expenses", expense_dict))
+    await invalidate_balance_snapshots(expense.agency_id, expense.date)
     
     # Deduct expense from agency balance
     new_balance = agency.get("balance", 0.0) - expense.amount
@@ -990,6 +2325,7 @@ async def create_expense(expense: ExpenseCreate, admin: dict = Depends(require_a
         {"id": expense.agency_id},
         {"$set": {"balance": new_balance}}
     )
+    await invalidate_response_cache("users", "expenses")
     
     return ExpenseResponse(**expense_dict)
 
@@ -1000,10 +2336,13 @@ async def get_expenses(current_user: dict = Depends(get_current_user)):
         query["agency_id"] = current_user["id"]
     
     expenses = await db.expenses.find(query, {"_id": 0}).to_list(length=None)
-    return [ExpenseResponse(**expense) for expense in expenses]
+    return model_list_response(ExpenseResponse, expenses)
 
 @api_router.get("/expenses/total")
 async def get_total_expenses(current_user: dict = Depends(get_current_user)):
+    return await load_expenses_total(current_user)
+
+async def load_expenses_total(current_user: dict) -> dict:
     query = {}
     if current_user["role"] == "sub_agency":
         query["agency_id"] = current_user["id"]
@@ -1029,8 +2368,424 @@ async def delete_expense(expense_id: str, admin: dict = Depends(require_admin)):
         )
     
     result = await db.expenses.delete_one({"id": expense_id})
+    await record_tombstones("expenses", [expense])
+    await invalidate_balance_snapshots(expense["agency_id"], expense.get("date"))
+    await invalidate_response_cache("users", "expenses")
     return {"message": "Expense deleted successfully"}
 
+# Agency statement
+STATEMENT_SORT = {"date": 1, "created_at": 1, "entry_id": 1}
+
+STATEMENT_COLUMNS = ["date", "entry_type", "description", "amount", "balance", "entry_id"]
+
+def statement_date_query(date_from: Optional[str], date_to: Optional[str]) -> dict:
+    date_query = {}
+    if date_from:
+        date_query["$gte"] = date_from
+    if date_to:
+        # Top-up dates carry a time part, so compare against the next day
+        try:
+            date_query["$lt"] = next_day(date_to)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid 'to' date")
+    return date_query
+
+def next_day(value: str) -> str:
+    return (date.fromisoformat(value[:10]) + timedelta(days=1)).isoformat()
+
+def build_statement_pipeline(agency_id: Optional[str], date_query: dict) -> list:
+    def match(date_field: str) -> dict:
+        query = {"agency_id": agency_id} if agency_id else {}
+        if date_query:
+            query.update(date_range_query(date_field, date_query))
+        return {"$match": query}
+    
+    reservation_entries = [
+        match("date_of_issue"),
+        {"$project": {
+            "_id": 0,
+            "agency_id": "$agency_id",
+            "entry_id": "$id",
+            "entry_type": {"$literal": "reservation"},
+            "date": "$date_of_issue",
+            "created_at": "$created_at",
+            "amount": {"$multiply": [{"$ifNull": ["$price", 0]}, -1]},
+            "description": {"$concat": [
+                {"$ifNull": ["$service_type", ""]},
+                ": ",
+                {"$ifNull": ["$tourist_names", ""]}
+            ]}
+        }}
+    ]
+    
+    return [
+        match("date"),
+        {"$project": {
+            "_id": 0,
+            "agency_id": "$agency_id",
+            "entry_id": "$id",
+            "entry_type": {"$literal": "topup"},
+            "date": "$date",
+            "created_at": "$created_at",
+            "amount": "$amount",
+            "description": "$type"
+        }},
+        {"$unionWith": {"coll": "expenses", "pipeline": [
+            match("date"),
+            {"$project": {
+                "_id": 0,
+                "agency_id": "$agency_id",
+                "entry_id": "$id",
+                "entry_type": {"$literal": "expense"},
+                "date": "$date",
+                "created_at": "$created_at",
+                "amount": {"$multiply": ["$amount", -1]},
+                "description": "$description"
+            }}
+        ]}},
+        {"$unionWith": {"coll": "reservations", "pipeline": reservation_entries}},
+        # Archived reservations stay on the ledger
+        {"$unionWith": {"coll": "reservations_archive", "pipeline": reservation_entries}}
+    ]
+
+async def ledger_total(agency_id: str, date_query: dict) -> float:
+    pipeline = build_statement_pipeline(agency_id, date_query)
+    pipeline.append({"$group": {"_id": None, "total": {"$sum": "$amount"}}})
+    result = await db.topups.aggregate(pipeline).to_list(1)
+    return result[0]["total"] if result else 0.0
+
+async def statement_opening_balance(agency_id: str, date_from: Optional[str]) -> float:
+    if not date_from:
+        return 0.0
+    return await balance_before(agency_id, date_from)
+
+def encode_statement_cursor(entry: dict, balance: float) -> str:
+    payload = {
+        "a": entry["agency_id"],
+        "d": entry["date"],
+        "c": entry.get("created_at"),
+        "i": entry["entry_id"],
+        "b": balance,
+        "aud": "statement-cursor",
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=STATEMENT_CURSOR_EXPIRE_MINUTES)
+    }
+    return jwt.encode(payload, CURSOR_SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_statement_cursor(cursor: str, agency_id: str) -> dict:
+    try:
+        position = jwt.decode(cursor, CURSOR_SECRET_KEY, algorithms=[ALGORITHM], audience="statement-cursor")
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=410, detail="Cursor has expired, reload the statement")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if position.get("a") != agency_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+def statement_after_cursor(position: dict) -> dict:
+    return {"$or": [
+        {"date": {"$gt": position["d"]}},
+        {"date": position["d"], "created_at": {"$gt": position["c"]}},
+        {"date": position["d"], "created_at": position["c"], "entry_id": {"$gt": position["i"]}}
+    ]}
+
+async def iterate_statement(agency_id: str, date_query: dict, opening_balance: float):
+    pipeline = build_statement_pipeline(agency_id, date_query) + [{"$sort": STATEMENT_SORT}]
+    balance = opening_balance
+    async for entry in db.topups.aggregate(pipeline):
+        balance = round(balance + entry.get("amount", 0), 2)
+        entry["balance"] = balance
+        yield entry
+
+def statement_xlsx_bytes(rows: List[list]) -> bytes:
+    # Runs in the process pool
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Statement")
+    sheet.append(STATEMENT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+async def statement_csv_rows(entries):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(STATEMENT_COLUMNS)
+    async for entry in entries:
+        writer.writerow([entry.get(column) for column in STATEMENT_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+@api_router.get("/users/{user_id}/statement")
+async def get_agency_statement(
+    user_id: str,
+    current_user: dict = Depends(get_current_user),
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: int = 200,
+    format: str = "json"
+):
+    if current_user["role"] == "sub_agency" and current_user["id"] != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if format not in ("json", "csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="Unsupported format, expected json, csv or xlsx")
+    
+    agency = await db.users.find_one({"id": user_id}, {"_id": 0, "agency_name": 1, "balance": 1})
+    if not agency:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    date_query = statement_date_query(date_from, date_to)
+    
+    if format != "json":
+        opening_balance = await statement_opening_balance(user_id, date_from)
+        entries = iterate_statement(user_id, date_query, opening_balance)
+        filename = f"statement_{user_id}_{date_from or 'start'}_{date_to or 'now'}"
+        
+        if format == "csv":
+            return StreamingResponse(
+                statement_csv_rows(entries),
+                media_type="text/csv",
+                headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+            )
+        
+        rows = [[entry.get(column) for column in STATEMENT_COLUMNS] async for entry in entries]
+        content = await run_in_process(statement_xlsx_bytes, rows)
+        return Response(
+            content=content,
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.xlsx"'}
+        )
+    
+    limit = max(1, min(limit, STATEMENT_MAX_PAGE_SIZE))
+    pipeline = build_statement_pipeline(user_id, date_query)
+    if cursor:
+        position = decode_statement_cursor(cursor, user_id)
+        opening_balance = position["b"]
+        pipeline.append({"$match": statement_after_cursor(position)})
+    else:
+        opening_balance = await statement_opening_balance(user_id, date_from)
+    pipeline += [{"$sort": STATEMENT_SORT}, {"$limit": limit + 1}]
+    
+    entries = await db.topups.aggregate(pipeline).to_list(limit + 1)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    
+    balance = opening_balance
+    for entry in entries:
+        balance = round(balance + entry.get("amount", 0), 2)
+        entry["balance"] = balance
+    
+    return {
+        "agency_id": user_id,
+        "agency_name": agency.get("agency_name", ""),
+        "from": date_from,
+        "to": date_to,
+        "opening_balance": round(opening_balance, 2),
+        "closing_balance": balance,
+        "current_balance": agency.get("balance", 0.0),
+        "entries": entries,
+        "next_cursor": encode_statement_cursor({**entries[-1], "agency_id": user_id}, balance) if has_more else None
+    }
+
+# Balance snapshots
+def snapshot_period_start(day: date) -> date:
+    month_index = (day.year * 12 + day.month - 1) // BALANCE_SNAPSHOT_PERIOD_MONTHS * BALANCE_SNAPSHOT_PERIOD_MONTHS
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def snapshot_boundaries(first_entry: str, today: date) -> List[str]:
+    boundaries = []
+    boundary = snapshot_period_start(date.fromisoformat(first_entry[:10]))
+    last = snapshot_period_start(today)
+    while boundary < last:
+        month_index = boundary.year * 12 + boundary.month - 1 + BALANCE_SNAPSHOT_PERIOD_MONTHS
+        boundary = date(month_index // 12, month_index % 12 + 1, 1)
+        boundaries.append(boundary.isoformat())
+    return boundaries
+
+async def ledger_totals_by_agency(date_query: dict) -> Dict[str, float]:
+    pipeline = build_statement_pipeline(None, date_query)
+    pipeline.append({"$group": {"_id": "$agency_id", "total": {"$sum": "$amount"}}})
+    result = await db.topups.aggregate(pipeline).to_list(length=None)
+    return {row["_id"]: row["total"] for row in result if row["_id"]}
+
+async def create_balance_snapshots() -> int:
+    pipeline = build_statement_pipeline(None, {})
+    pipeline.append({"$group": {"_id": None, "first": {"$min": "$date"}}})
+    result = await db.topups.aggregate(pipeline).to_list(1)
+    if not result or not result[0].get("first"):
+        return 0
+    
+    agencies = await db.users.find({"role": "sub_agency"}, {"_id": 0, "id": 1}).to_list(length=None)
+    agency_ids = [a["id"] for a in agencies]
+    
+    existing = await db.balance_snapshots.find({}, {"_id": 0, "agency_id": 1, "as_of": 1, "balance": 1}).to_list(length=None)
+    balances = {(s["agency_id"], s["as_of"]): s["balance"] for s in existing}
+    
+    # Each missing snapshot is the previous one plus one period of entries
+    created = 0
+    previous = None
+    now = datetime.now(timezone.utc).isoformat()
+    for boundary in snapshot_boundaries(result[0]["first"], datetime.now(timezone.utc).date()):
+        missing = [a for a in agency_ids if (a, boundary) not in balances]
+        if missing:
+            date_query = {"$gte": previous, "$lt": boundary} if previous else {"$lt": boundary}
+            deltas = await ledger_totals_by_agency(date_query)
+            operations = []
+            for agency_id in missing:
+                balance = round(balances.get((agency_id, previous), 0.0) + deltas.get(agency_id, 0.0), 2)
+                balances[(agency_id, boundary)] = balance
+                operations.append(UpdateOne(
+                    {"agency_id": agency_id, "as_of": boundary},
+                    {"$set": {"balance": balance, "created_at": now}},
+                    upsert=True
+                ))
+            await db.balance_snapshots.bulk_write(operations, ordered=False)
+            created += len(operations)
+        previous = boundary
+    
+    if created:
+        logger.info(f"Created {created} balance snapshots")
+    return created
+
+async def invalidate_balance_snapshots(agency_id: Optional[str], entry_date: Optional[str]):
+    # A change to an entry dated before a snapshot makes that snapshot stale
+    if not agency_id or not entry_date:
+        return
+    await db.balance_snapshots.delete_many({"agency_id": agency_id, "as_of": {"$gt": entry_date}})
+
+async def balance_before(agency_id: str, before: str) -> float:
+    snapshot = await db.balance_snapshots.find_one(
+        {"agency_id": agency_id, "as_of": {"$lte": before}},
+        {"_id": 0, "as_of": 1, "balance": 1},
+        sort=[("as_of", -1)]
+    )
+    if snapshot:
+        delta = await ledger_total(agency_id, {"$gte": snapshot["as_of"], "$lt": before})
+        return snapshot["balance"] + delta
+    return await ledger_total(agency_id, {"$lt": before})
+
+@api_router.get("/users/{user_id}/balance")
+async def get_historical_balance(user_id: str, at: str, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] == "sub_agency" and current_user["id"] != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    try:
+        before = next_day(at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date")
+    
+    agency = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1})
+    if not agency:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    balance = await balance_before(user_id, before)
+    return {"agency_id": user_id, "at": at, "balance": round(balance, 2)}
+
+@api_router.post("/balance-snapshots/run")
+async def run_balance_snapshots(admin: dict = Depends(require_admin)):
+    created = await create_balance_snapshots()
+    return {"message": "Balance snapshots updated", "created": created}
+
+@api_router.get("/balance-snapshots/verify")
+async def verify_balance_snapshots(agency_id: Optional[str] = None, admin: dict = Depends(require_admin)):
+    query = {"agency_id": agency_id} if agency_id else {}
+    snapshots = await db.balance_snapshots.find(query, {"_id": 0}).sort("as_of", 1).to_list(length=None)
+    
+    # One full recomputation per snapshot date, covering all agencies
+    expected_by_date = {}
+    for as_of in sorted({s["as_of"] for s in snapshots}):
+        expected_by_date[as_of] = await ledger_totals_by_agency({"$lt": as_of})
+    
+    mismatches = []
+    for snapshot in snapshots:
+        expected = round(expected_by_date[snapshot["as_of"]].get(snapshot["agency_id"], 0.0), 2)
+        if abs(expected - snapshot["balance"]) > 0.005:
+            mismatches.append({
+                "agency_id": snapshot["agency_id"],
+                "as_of": snapshot["as_of"],
+                "snapshot_balance": snapshot["balance"],
+                "expected_balance": expected
+            })
+    
+    return {"checked": len(snapshots), "mismatches": mismatches}
+
+# Balance reconciliation
+async def reconcile_balances(correct: bool = False, triggered_by: str = "schedule") -> dict:
+    # Balances are read before the ledger and again after it. A write landing between the reads changes
+    # the balance, and that agency is left for the next run instead of being corrected from a stale view
+    agencies = await db.users.find(
+        {"role": "sub_agency"},
+        {"_id": 0, "id": 1, "agency_name": 1, "balance": 1}
+    ).to_list(length=None)
+    expected_balances = await ledger_totals_by_agency({})
+    
+    discrepancies = []
+    for agency in agencies:
+        stored = agency.get("balance", 0.0)
+        expected = round(expected_balances.get(agency["id"], 0.0), 2)
+        if abs(stored - expected) > 0.005:
+            discrepancies.append({
+                "agency_id": agency["id"],
+                "agency_name": agency.get("agency_name", ""),
+                "stored_balance": stored,
+                "expected_balance": expected,
+                "difference": round(stored - expected, 2)
+            })
+    
+    changed = 0
+    if discrepancies:
+        rechecked = await db.users.find(
+            {"id": {"$in": [d["agency_id"] for d in discrepancies]}},
+            {"_id": 0, "id": 1, "balance": 1}
+        ).to_list(length=None)
+        current = {agency["id"]: agency.get("balance", 0.0) for agency in rechecked}
+        settled = [d for d in discrepancies if current.get(d["agency_id"]) == d["stored_balance"]]
+        changed = len(discrepancies) - len(settled)
+        discrepancies = settled
+    
+    corrected = 0
+    if correct and discrepancies:
+        # Only overwrite balances that have not changed since they were read
+        result = await db.users.bulk_write([
+            UpdateOne(
+                {"id": d["agency_id"], "balance": d["stored_balance"]},
+                {"$set": {"balance": d["expected_balance"]}}
+            )
+            for d in discrepancies
+        ], ordered=False)
+        corrected = result.modified_count
+        await invalidate_response_cache("users")
+    
+    report = {
+        "id": str(uuid.uuid4()),
+        "triggered_by": triggered_by,
+        "checked": len(agencies),
+        "discrepancies": discrepancies,
+        "changed_during_check": changed,
+        "corrected": corrected,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.reconciliation_reports.insert_one(dict(report))
+    
+    if discrepancies:
+        logger.warning(f"Balance reconciliation found {len(discrepancies)} discrepancies, corrected {corrected}")
+    return report
+
+async def scheduled_balance_reconciliation():
+    await reconcile_balances(correct=BALANCE_RECONCILIATION_AUTO_CORRECT)
+
+@api_router.post("/balance-reconciliation")
+async def run_balance_reconciliation(correct: bool = False, admin: dict = Depends(require_admin)):
+    return await reconcile_balances(correct=correct, triggered_by=admin["id"])
+
+@api_router.get("/balance-reconciliation/reports")
+async def get_reconciliation_reports(limit: int = 20, admin: dict = Depends(require_admin)):
+    return await db.reconciliation_reports.find({}, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+
 # Request Endpoints
 @api_router.post("/requests", response_model=RequestResponse)
 async def create_request(request: RequestCreate, current_user: dict = Depends(get_current_user)):
@@ -1049,18 +2804,111 @@ async def create_request(request: RequestCreate, current_user: dict = Depends(ge
     await db.requests.insert_one(request_dict)
     return RequestResponse(**request_dict)
 
-@api_router.get("/requests", response_model=List[RequestResponse])
-async def get_requests(current_user: dict = Depends(get_current_user)):
+def build_request_query(
+    user: dict,
+    country: Optional[str] = None,
+    check_in_from: Optional[str] = None,
+    check_in_to: Optional[str] = None,
+    search: Optional[str] = None
+) -> dict:
     query = {}
-    if current_user["role"] == "sub_agency":
-        query["agency_id"] = current_user["id"]
+    if user["role"] == "sub_agency":
+        query["agency_id"] = user["id"]
+    
+    if country:
+        query["country"] = country
+    
+    if check_in_from or check_in_to:
+        date_query = {}
+        if check_in_from:
+            date_query["$gte"] = check_in_from
+        if check_in_to:
+            date_query["$lte"] = check_in_to
+        query["check_in"] = date_query
+    
+    if search:
+        pattern = re.escape(search)
+        query["$or"] = [
+            {"location": {"$regex": pattern, "$options": "i"}},
+            {"hotel": {"$regex": pattern, "$options": "i"}},
+            {"description": {"$regex": pattern, "$options": "i"}}
+        ]
+    
+    return query
+
+@api_router.get("/requests")
+async def get_requests(
+    current_user: dict = Depends(get_current_user),
+    reservation_status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    document_status: Optional[str] = None,
+    country: Optional[str] = None,
+    check_in_from: Optional[str] = None,
+    check_in_to: Optional[str] = None,
+    search: Optional[str] = None,
+    sort_by: str = "created_at",
+    sort_order: str = "desc",
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=1000),
+    include_archived: bool = False
+):
+    if sort_by not in REQUEST_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {sort_by}")
+    
+    query = build_request_query(current_user, country, check_in_from, check_in_to, search)
+    
+    status_query = {}
+    if reservation_status:
+        status_query["reservation_status"] = reservation_status
+    if payment_status:
+        status_query["payment_status"] = payment_status
+    if document_status:
+        status_query["document_status"] = document_status
+    
+    skip = (page - 1) * limit
+    direction = 1 if sort_order == "asc" else -1
+    sort = [(sort_by, direction), ("id", direction)]
+    page_query = {**query, **status_query}
+    archive = "requests_archive" if include_archived else None
+    
+    # The page and total are indexed queries; archived requests need a union, so that page is aggregated
+    if archive:
+        page_rows = db.requests.aggregate(match_with_archive(page_query, archive) + [
+            {"$sort": dict(sort)},
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$project": {"_id": 0}}
+        ]).to_list(limit)
+    else:
+        page_rows = db.requests.find(page_query, {"_id": 0}).sort(sort).skip(skip).limit(limit).to_list(limit)
+    totals = [db.requests.count_documents(page_query)]
+    if archive:
+        totals.append(db[archive].count_documents(page_query))
     
-    requests = await db.requests.find(query, {"_id": 0}).to_list(length=None)
-    return [RequestResponse(**req) for req in requests]
+    # Status counts ignore the status filters so every badge stays visible
+    count_facets = {field: [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}] for field in REQUEST_STATUS_FIELDS}
+    count_rows = db.requests.aggregate(match_with_archive(query, archive) + [{"$facet": count_facets}]).to_list(1)
+    
+    rows, count_result, *total_counts = await asyncio.gather(page_rows, count_rows, *totals)
+    count_result = count_result[0] if count_result else {}
+    total = sum(total_counts)
+    counts = {
+        field: {bucket["_id"]: bucket["count"] for bucket in count_result.get(field, []) if bucket["_id"] is not None}
+        for field in REQUEST_STATUS_FIELDS
+    }
+    
+    return {
+        "requests": dump_model_list(RequestResponse, rows),
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "pages": (total + limit - 1) // limit,
+        "counts": counts
+    }
 
 @api_router.get("/requests/{request_id}", response_model=RequestResponse)
 async def get_request(request_id: str, current_user: dict = Depends(get_current_user)):
-    request = await db.requests.find_one({"id": request_id}, {"_id": 0})
+    request, _ = await load_request_with_archive(request_id)
     if not request:
         raise HTTPException(status_code=404, detail="Request not found")
     
@@ -1078,17 +2926,48 @@ async def update_request(request_id: str, update: RequestUpdate, admin: dict = D
     
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    result = await db.requests.update_one(
+    request = await db.requests.find_one_and_update(
         {"id": request_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.matched_count == 0:
+    if not request:
         raise HTTPException(status_code=404, detail="Request not found")
     
-    request = await db.requests.find_one({"id": request_id}, {"_id": 0})
     return RequestResponse(**request)
 
+@api_router.post("/requests/bulk-update")
+async def bulk_update_requests(data: RequestBulkUpdate, admin: dict = Depends(require_admin)):
+    update_data = {k: v for k, v in data.model_dump(include=set(RequestUpdate.model_fields)).items() if v is not None}
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No update data provided")
+    
+    query = bulk_filter_fields(data.filter)
+    ids, found = await resolve_bulk_targets(db.requests, data.ids, query)
+    
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    operations = [UpdateOne({"id": rid}, {"$set": update_data}) for rid in ids if rid in found]
+    if operations:
+        await db.requests.bulk_write(operations, ordered=False)
+    
+    results = [{"id": rid, "status": "updated" if rid in found else "not_found"} for rid in ids]
+    return {
+        "message": "Requests updated",
+        "updated": len(operations),
+        "not_found": len(ids) - len(operations),
+        "results": results
+    }
+
+async def load_request_with_archive(request_id: str) -> tuple:
+    # Archived requests can still be read, but writes only look at the live collection
+    request = await db.requests.find_one({"id": request_id}, {"_id": 0})
+    if request is not None:
+        return request, False
+    request = await db.requests_archive.find_one({"id": request_id}, {"_id": 0})
+    return request, request is not None
+
 # Comment Endpoints
 @api_router.post("/requests/{request_id}/comments", response_model=CommentResponse)
 async def add_comment(request_id: str, comment: CommentCreate, current_user: dict = Depends(get_current_user)):
@@ -1107,7 +2986,8 @@ async def add_comment(request_id: str, comment: CommentCreate, current_user: dic
         "user_name": current_user["agency_name"],
         "user_role": current_user["role"],
         "text": comment.text,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.comments.insert_one(comment_dict)
@@ -1154,7 +3034,8 @@ async def add_comment_with_file(
         "text": text,
         "attachment_id": attachment_id,
         "attachment_filename": attachment_filename,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.comments.insert_one(comment_dict)
@@ -1164,15 +3045,16 @@ async def add_comment_with_file(
 @api_router.get("/requests/{request_id}/comments", response_model=List[CommentResponse])
 async def get_comments(request_id: str, current_user: dict = Depends(get_current_user)):
     # Check if request exists and user has access
-    request = await db.requests.find_one({"id": request_id}, {"_id": 0})
+    request, archived = await load_request_with_archive(request_id)
     if not request:
         raise HTTPException(status_code=404, detail="Request not found")
     
     if current_user["role"] == "sub_agency" and request["agency_id"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    comments = await db.comments.find({"request_id": request_id}, {"_id": 0}).sort("created_at", 1).to_list(length=None)
-    return [CommentResponse(**comment) for comment in comments]
+    collection = db.comments_archive if archived else db.comments
+    comments = await collection.find({"request_id": request_id}, {"_id": 0}).sort("created_at", 1).to_list(length=None)
+    return model_list_response(CommentResponse, comments)
 
 # Document Upload/Download
 UPLOAD_DIR = Path("/app/uploads")
@@ -1209,7 +3091,7 @@ async def upload_document(request_id: str, file: UploadFile = File(...), user: d
     # Automatically update document status to "documents_ready"
     await db.requests.update_one(
         {"id": request_id},
-        {"$set": {"document_status": "documents_ready"}}
+        {"$set": {"document_status": "documents_ready", "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     
     return {"message": "File uploaded successfully", "document_id": file_id, "filename": file.filename}
@@ -1217,24 +3099,27 @@ async def upload_document(request_id: str, file: UploadFile = File(...), user: d
 @api_router.get("/requests/{request_id}/documents", response_model=List[DocumentResponse])
 async def get_documents(request_id: str, current_user: dict = Depends(get_current_user)):
     # Check if request exists and user has access
-    request = await db.requests.find_one({"id": request_id}, {"_id": 0})
+    request, archived = await load_request_with_archive(request_id)
     if not request:
         raise HTTPException(status_code=404, detail="Request not found")
     
     if current_user["role"] == "sub_agency" and request["agency_id"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    documents = await db.documents.find({"request_id": request_id}, {"_id": 0}).to_list(length=None)
+    collection = db.documents_archive if archived else db.documents
+    documents = await collection.find({"request_id": request_id}, {"_id": 0}).to_list(length=None)
     return [DocumentResponse(**doc) for doc in documents]
 
 @api_router.get("/documents/{document_id}/download")
 async def download_document(document_id: str, current_user: dict = Depends(get_current_user)):
     document = await db.documents.find_one({"id": document_id}, {"_id": 0})
+    if not document:
+        document = await db.documents_archive.find_one({"id": document_id}, {"_id": 0})
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Check access
-    request = await db.requests.find_one({"id": document["request_id"]}, {"_id": 0})
+    request, _ = await load_request_with_archive(document["request_id"])
     if current_user["role"] == "sub_agency" and request["agency_id"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
@@ -1252,11 +3137,13 @@ async def download_document(document_id: str, current_user: dict = Depends(get_c
 @api_router.get("/comments/{comment_id}/attachment")
 async def download_comment_attachment(comment_id: str, current_user: dict = Depends(get_current_user)):
     comment = await db.comments.find_one({"id": comment_id}, {"_id": 0})
+    if not comment:
+        comment = await db.comments_archive.find_one({"id": comment_id}, {"_id": 0})
     if not comment or not comment.get("attachment_id"):
         raise HTTPException(status_code=404, detail="Attachment not found")
     
     # Check access
-    request = await db.requests.find_one({"id": comment["request_id"]}, {"_id": 0})
+    request, _ = await load_request_with_archive(comment["request_id"])
     if current_user["role"] == "sub_agency" and request["agency_id"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
@@ -1280,8 +3167,1144 @@ async def download_comment_attachment(comment_id: str, current_user: dict = Depe
     )
 
 
+# Delta sync
+SYNC_MODELS = {
+    "requests": RequestResponse,
+    "comments": CommentResponse,
+    "topups": TopUpResponse,
+    "expenses": ExpenseResponse
+}
+
+async def record_tombstones(collection: str, docs: List[dict], reason: str = "deleted"):
+    if not docs:
+        return
+    now = datetime.now(timezone.utc)
+    await db.tombstones.insert_many([
+        {
+            "collection": collection,
+            "id": doc["id"],
+            "agency_id": doc.get("agency_id"),
+            "reason": reason,
+            "updated_at": now.isoformat(),
+            "expires_at": now + timedelta(days=SYNC_TOMBSTONE_DAYS)
+        }
+        for doc in docs
+    ])
+
+async def backfill_updated_at():
+    # Records written before delta sync have no updated_at; their creation time stands in for it
+    for name in SYNC_COLLECTIONS:
+        await db[name].update_many({"updated_at": {"$exists": False}}, [{"$set": {"updated_at": "$created_at"}}])
+
+def encode_sync_token(user: dict, positions: dict, issued_at: datetime) -> str:
+    # Deletions older than the tombstone retention can no longer be reported, so the token expires with them
+    payload = {
+        "u": user["id"],
+        "p": positions,
+        "aud": "sync",
+        "exp": issued_at + timedelta(days=SYNC_TOMBSTONE_DAYS)
+    }
+    return jwt.encode(payload, CURSOR_SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_sync_token(token: str, user: dict) -> dict:
+    try:
+        payload = jwt.decode(token, CURSOR_SECRET_KEY, algorithms=[ALGORITHM], audience="sync")
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=410, detail="Sync token expired, start a full sync")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    if payload.get("u") != user["id"] or not isinstance(payload.get("p"), dict):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return payload["p"]
+
+async def read_changes(collection, query: dict, projection: dict, position: list) -> tuple:
+    updated_at, last_id = position
+    after = {"$or": [
+        {"updated_at": {"$gt": updated_at}},
+        {"updated_at": updated_at, "id": {"$gt": last_id}}
+    ]}
+    docs = await collection.find({**query, **after}, projection).sort(
+        [("updated_at", 1), ("id", 1)]
+    ).limit(SYNC_PAGE_SIZE + 1).to_list(SYNC_PAGE_SIZE + 1)
+    return docs[:SYNC_PAGE_SIZE], len(docs) > SYNC_PAGE_SIZE
+
+@api_router.get("/sync")
+async def sync_changes(since: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    now = datetime.now(timezone.utc)
+    horizon = (now - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()
+    
+    if since:
+        positions = decode_sync_token(since, current_user)
+    else:
+        # A full sync reads every record; only deletions made while it pages through matter
+        positions = {name: ["", ""] for name in SYNC_COLLECTIONS}
+        positions["tombstones"] = [horizon, ""]
+    
+    scopes = {name: {} for name in SYNC_COLLECTIONS}
+    tombstone_scope = {"collection": {"$in": list(SYNC_COLLECTIONS)}}
+    if current_user["role"] == "sub_agency":
+        for name in ("reservations", "requests", "topups", "expenses"):
+            scopes[name] = {"agency_id": current_user["id"]}
+        request_ids = await db.requests.distinct("id", {"agency_id": current_user["id"]})
+        scopes["comments"] = {"request_id": {"$in": request_ids}}
+        tombstone_scope["agency_id"] = current_user["id"]
+    
+    projections = {name: {"_id": 0, "dates": 0} for name in SYNC_COLLECTIONS}
+    projections["reservations"] = reservation_projection(current_user)
+    
+    streams = list(SYNC_COLLECTIONS) + ["tombstones"]
+    results = await asyncio.gather(*(
+        read_changes(db.tombstones, tombstone_scope, {"_id": 0, "collection": 1, "id": 1, "updated_at": 1}, positions["tombstones"])
+        if name == "tombstones"
+        else read_changes(db[name], scopes[name], projections[name], positions[name])
+        for name in streams
+    ))
+    
+    changes = {}
+    deleted = {name: [] for name in SYNC_COLLECTIONS}
+    next_positions = {}
+    for name, (docs, has_more) in zip(streams, results):
+        if docs and (has_more or docs[-1]["updated_at"] <= horizon):
+            next_positions[name] = [docs[-1]["updated_at"], docs[-1]["id"]]
+        elif docs:
+            # Records newer than the horizon are read again next time instead of being skipped past
+            next_positions[name] = [horizon, ""]
+        else:
+            next_positions[name] = positions[name]
+        
+        if name == "tombstones":
+            for tombstone in docs:
+                deleted[tombstone["collection"]].append(tombstone["id"])
+        elif name in SYNC_MODELS:
+            changes[name] = dump_model_list(SYNC_MODELS[name], docs)
+        else:
+            changes[name] = docs
+    
+    return {
+        "changes": changes,
+        "deleted": deleted,
+        "has_more": any(has_more for _, has_more in results),
+        "next": encode_sync_token(current_user, next_positions, now)
+    }
+
+# Background jobs
+class JobCreate(BaseModel):
+    type: str
+    params: Dict[str, Any] = {}
+
+JOB_TYPES: Dict[str, dict] = {}
+
+job_wakeup = asyncio.Event()
+process_pool: Optional[ProcessPoolExecutor] = None
+
+def job_type(name: str, concurrency: int = 1, max_attempts: int = 3):
+    def register(handler):
+        JOB_TYPES[name] = {"handler": handler, "concurrency": concurrency, "max_attempts": max_attempts}
+        return handler
+    return register
+
+async def run_in_process(func, *args):
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=JOB_PROCESS_WORKERS)
+    return await asyncio.get_running_loop().run_in_executor(process_pool, func, *args)
+
+async def enqueue_job(job_type_name: str, params: dict, created_by: Optional[str] = None, schedule_key: Optional[str] = None) -> dict:
+    if job_type_name not in JOB_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job_type_name}")
+    
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type_name,
+        "params": params,
+        "status": "queued",
+        "progress": 0,
+        "progress_message": None,
+        "attempts": 0,
+        "max_attempts": JOB_TYPES[job_type_name]["max_attempts"],
+        "result": None,
+        "result_file": None,
+        "result_filename": None,
+        "error": None,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "run_after": now,
+        "created_by": created_by,
+        "created_at": now.isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "updated_at": now.isoformat()
+    }
+    if schedule_key:
+        job["schedule_key"] = schedule_key
+    await db.jobs.insert_one(dict(job))
+    job_wakeup.set()
+    return job
+
+async def enqueue_scheduled_job(job_type_name: str, interval_seconds: int) -> Optional[dict]:
+    # Every worker runs the schedule: skip while an earlier run is still pending,
+    # and let the unique schedule_key admit one job per interval when workers race
+    pending = await db.jobs.find_one({"type": job_type_name, "status": {"$in": ["queued", "running"]}}, {"_id": 1})
+    if pending:
+        return None
+    
+    schedule_key = f"{job_type_name}:{int(time.time() // interval_seconds)}"
+    try:
+        return await enqueue_job(job_type_name, {}, schedule_key=schedule_key)
+    except DuplicateKeyError:
+        return None
+
+async def ensure_job_slots():
+    # One document per concurrent run of each job type; a worker holds a slot for as long as it runs the job
+    for name, spec in JOB_TYPES.items():
+        for index in range(spec["concurrency"]):
+            await db.job_slots.update_one(
+                {"_id": f"{name}:{index}"},
+                {"$setOnInsert": {"type": name, "index": index, "job_id": None}},
+                upsert=True
+            )
+
+async def claim_job_slot(job_type_name: str, worker_id: str, now: datetime) -> Optional[str]:
+    # Slots whose lease expired belong to a dead worker
+    slot = await db.job_slots.find_one_and_update(
+        {
+            "type": job_type_name,
+            "index": {"$lt": JOB_TYPES[job_type_name]["concurrency"]},
+            "$or": [{"job_id": None}, {"lease_expires_at": {"$lt": now}}]
+        },
+        {"$set": {
+            "job_id": "claiming",
+            "lease_owner": worker_id,
+            "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS)
+        }},
+        projection={"_id": 1}
+    )
+    return slot["_id"] if slot else None
+
+async def release_job_slot(slot_id: str, worker_id: str):
+    await db.job_slots.update_one(
+        {"_id": slot_id, "lease_owner": worker_id},
+        {"$set": {"job_id": None, "lease_owner": None, "lease_expires_at": None}}
+    )
+
+async def claim_job(worker_id: str) -> Optional[dict]:
+    now = datetime.now(timezone.utc)
+    # Jobs whose lease expired belong to a dead worker and are picked up again
+    ready = {"$or": [
+        {"status": "queued", "run_after": {"$lte": now}},
+        {"status": "running", "lease_expires_at": {"$lt": now}}
+    ]}
+    waiting = await db.jobs.aggregate([
+        {"$match": ready},
+        {"$group": {"_id": "$type", "oldest": {"$min": "$created_at"}}},
+        {"$sort": {"oldest": 1}}
+    ]).to_list(length=None)
+    
+    # Per-type concurrency holds across workers because a job is only claimed while holding one of its type's slots
+    for row in waiting:
+        if row["_id"] not in JOB_TYPES:
+            continue
+        slot_id = await claim_job_slot(row["_id"], worker_id, now)
+        if slot_id is None:
+            continue
+        
+        job = await db.jobs.find_one_and_update(
+            {"type": row["_id"], **ready},
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "slot": slot_id,
+                    "started_at": now.isoformat(),
+                    "updated_at": now.isoformat()
+                },
+                "$inc": {"attempts": 1}
+            },
+            projection={"_id": 0},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job:
+            await db.job_slots.update_one({"_id": slot_id, "lease_owner": worker_id}, {"$set": {"job_id": job["id"]}})
+            return job
+        await release_job_slot(slot_id, worker_id)
+    return None
+
+async def update_owned_job(job_id: str, worker_id: str, fields: dict):
+    fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+    await db.jobs.update_one({"id": job_id, "lease_owner": worker_id}, {"$set": fields})
+
+async def renew_job_lease(job: dict, worker_id: str):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        lease_expires_at = datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)
+        # A failed renewal is retried on the next beat; ending the loop would let the lease lapse mid-job
+        try:
+            await update_owned_job(job["id"], worker_id, {"lease_expires_at": lease_expires_at})
+            await db.job_slots.update_one(
+                {"_id": job["slot"], "lease_owner": worker_id},
+                {"$set": {"lease_expires_at": lease_expires_at}}
+            )
+        except Exception:
+            logger.exception(f"Could not renew the lease of job {job['id']}")
+
+async def run_job(job: dict, worker_id: str):
+    if job["attempts"] > job["max_attempts"]:
+        await update_owned_job(job["id"], worker_id, {
+            "status": "failed",
+            "error": "Worker lost the job too many times",
+            "lease_owner": None,
+            "finished_at": datetime.now(timezone.utc).isoformat()
+        })
+        return
+    
+    async def progress(percent: int, message: Optional[str] = None):
+        await update_owned_job(job["id"], worker_id, {"progress": percent, "progress_message": message})
+    
+    heartbeat = asyncio.create_task(renew_job_lease(job, worker_id))
+    try:
+        result = await JOB_TYPES[job["type"]]["handler"](job, progress) or {}
+    except Exception as e:
+        logger.exception(f"Job {job['id']} ({job['type']}) failed")
+        if job["attempts"] < job["max_attempts"]:
+            fields = {
+                "status": "queued",
+                "error": str(e),
+                "lease_owner": None,
+                "run_after": datetime.now(timezone.utc) + timedelta(seconds=JOB_RETRY_DELAY_SECONDS * job["attempts"])
+            }
+        else:
+            fields = {
+                "status": "failed",
+                "error": str(e),
+                "lease_owner": None,
+                "finished_at": datetime.now(timezone.utc).isoformat()
+            }
+        await update_owned_job(job["id"], worker_id, fields)
+        return
+    finally:
+        heartbeat.cancel()
+    
+    await update_owned_job(job["id"], worker_id, {
+        "status": "succeeded",
+        "progress": 100,
+        "result_file": result.pop("file", None),
+        "result_filename": result.pop("filename", None),
+        "result": result,
+        "error": None,
+        "lease_owner": None,
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    })
+
+async def job_worker(worker_id: str):
+    while True:
+        try:
+            job = await claim_job(worker_id)
+        except Exception:
+            logger.exception("Could not claim a job")
+            job = None
+        
+        if job:
+            # Bookkeeping errors must not end the worker; an unfinished job is taken over once its lease expires
+            try:
+                await run_job(job, worker_id)
+            except Exception:
+                logger.exception(f"Job {job['id']} ({job['type']}) could not be recorded")
+            finally:
+                try:
+                    await release_job_slot(job["slot"], worker_id)
+                except Exception:
+                    logger.exception(f"Could not release the slot of job {job['id']}")
+            continue
+        
+        job_wakeup.clear()
+        try:
+            await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+def start_job_workers():
+    STATEMENT_FILES_DIR.mkdir(parents=True, exist_ok=True)
+    for index in range(JOB_WORKERS):
+        worker_id = f"{os.getpid()}-{index}-{uuid.uuid4().hex[:8]}"
+        background_tasks.append(asyncio.create_task(job_worker(worker_id)))
+
+def write_table_file(path: str, file_format: str, columns: List[str], rows: List[list]):
+    # Runs in the process pool
+    if file_format == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        return
+    
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+@job_type("balance_reconciliation")
+async def balance_reconciliation_job(job: dict, progress):
+    return await reconcile_balances(correct=bool(job["params"].get("correct")), triggered_by=job["created_by"] or "job")
+
+@job_type("balance_snapshots")
+async def balance_snapshots_job(job: dict, progress):
+    return {"created": await create_balance_snapshots()}
+
+@job_type("statement_export", concurrency=2)
+async def statement_export_job(job: dict, progress):
+    params = job["params"]
+    agency_id = params.get("agency_id")
+    file_format = params.get("format", "xlsx")
+    if not agency_id or file_format not in ("csv", "xlsx"):
+        raise ValueError("statement_export needs agency_id and format csv or xlsx")
+    
+    date_query = statement_date_query(params.get("from"), params.get("to"))
+    opening_balance = await statement_opening_balance(agency_id, params.get("from"))
+    rows = [
+        [entry.get(column) for column in STATEMENT_COLUMNS]
+        async for entry in iterate_statement(agency_id, date_query, opening_balance)
+    ]
+    await progress(50, f"{len(rows)} entries loaded")
+    
+    path = JOB_RESULTS_DIR / f"{job['id']}.{file_format}"
+    await run_in_process(write_table_file, str(path), file_format, STATEMENT_COLUMNS, rows)
+    return {
+        "file": str(path),
+        "filename": f"statement_{agency_id}_{params.get('from') or 'start'}_{params.get('to') or 'now'}.{file_format}",
+        "rows": len(rows)
+    }
+
+STATEMENT_FILE_MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+def statement_period_range(period: str) -> tuple:
+    try:
+        start = date.fromisoformat(f"{period}-01")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid period, expected YYYY-MM")
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+def previous_statement_period() -> str:
+    return (date.today().replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+
+def render_statement_file(path: str, file_format: str, header: dict, rows: List[list]):
+    # Runs in the process pool; writes next to the target so readers never see a partial file,
+    # under a name of its own so concurrent renders of the same statement never share it
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write_statement_file(tmp_path, file_format, header, rows)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def write_statement_file(tmp_path: str, file_format: str, header: dict, rows: List[list]):
+    if file_format == "xlsx":
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Statement")
+        sheet.append([header["title"]])
+        sheet.append(["Opening balance", header["opening_balance"]])
+        sheet.append(["Closing balance", header["closing_balance"]])
+        sheet.append([])
+        sheet.append(STATEMENT_COLUMNS)
+        for row in rows:
+            sheet.append(row)
+        workbook.save(tmp_path)
+    else:
+        from xml.sax.saxutils import escape
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4, landscape
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+        # The entry id is only useful for spreadsheets, not on paper
+        styles = getSampleStyleSheet()
+        table = Table(
+            [STATEMENT_COLUMNS[:-1]] + [
+                [row[0], row[1], Paragraph(escape(str(row[2] or "")), styles["BodyText"]), f"{row[3] or 0:.2f}", f"{row[4] or 0:.2f}"]
+                for row in rows
+            ],
+            colWidths=[80, 80, 380, 80, 80],
+            repeatRows=1
+        )
+        table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+            ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+            ("ALIGN", (3, 0), (-1, -1), "RIGHT"),
+            ("VALIGN", (0, 0), (-1, -1), "TOP")
+        ]))
+        document = SimpleDocTemplate(tmp_path, pagesize=landscape(A4), title=header["title"])
+        document.build([
+            Paragraph(escape(header["title"]), styles["Title"]),
+            Paragraph(f"Opening balance: {header['opening_balance']:.2f}", styles["Normal"]),
+            Paragraph(f"Closing balance: {header['closing_balance']:.2f}", styles["Normal"]),
+            Spacer(1, 12),
+            table
+        ])
+
+async def generate_statement_file(agency: dict, period: str, file_format: str) -> dict:
+    date_from, date_to = statement_period_range(period)
+    opening_balance = round(await statement_opening_balance(agency["id"], date_from), 2)
+    rows = [
+        [entry.get(column) for column in STATEMENT_COLUMNS]
+        async for entry in iterate_statement(agency["id"], statement_date_query(date_from, date_to), opening_balance)
+    ]
+    header = {
+        "title": f"{agency.get('agency_name', '')} statement {period}",
+        "opening_balance": opening_balance,
+        "closing_balance": rows[-1][STATEMENT_COLUMNS.index("balance")] if rows else opening_balance
+    }
+
+    # The data version changes whenever any ledger entry of the period does
+    data_version = hashlib.sha256(json.dumps([header, rows], default=str).encode()).hexdigest()[:16]
+    key = {"agency_id": agency["id"], "period": period, "format": file_format}
+    cached = await db.statement_files.find_one({**key, "data_version": data_version}, {"_id": 0})
+    if cached and Path(cached["file"]).exists():
+        return {**cached, "cached": True}
+
+    path = STATEMENT_FILES_DIR / f"{agency['id']}_{period}_{data_version}.{file_format}"
+    await run_in_process(render_statement_file, str(path), file_format, header, rows)
+
+    statement_file = {
+        **key,
+        "data_version": data_version,
+        "file": str(path),
+        "filename": f"statement_{agency['id']}_{period}.{file_format}",
+        "rows": len(rows),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.statement_files.update_one({**key, "data_version": data_version}, {"$set": statement_file}, upsert=True)
+
+    stale_query = {**key, "data_version": {"$ne": data_version}}
+    for stale in await db.statement_files.find(stale_query, {"_id": 0, "file": 1}).to_list(None):
+        Path(stale["file"]).unlink(missing_ok=True)
+    await db.statement_files.delete_many(stale_query)
+    return {**statement_file, "cached": False}
+
+@job_type("monthly_statements")
+async def monthly_statements_job(job: dict, progress):
+    params = job["params"]
+    period = params.get("period") or previous_statement_period()
+    formats = params.get("formats") or list(STATEMENT_FILE_MEDIA_TYPES)
+    if any(file_format not in STATEMENT_FILE_MEDIA_TYPES for file_format in formats):
+        raise ValueError("monthly_statements formats must be pdf or xlsx")
+    statement_period_range(period)
+
+    query = {"role": "sub_agency"}
+    if params.get("agency_ids"):
+        query["id"] = {"$in": params["agency_ids"]}
+    agencies = await db.users.find(query, {"_id": 0, "id": 1, "agency_name": 1}).to_list(None)
+
+    # Keep at most one render per pool process in flight
+    semaphore = asyncio.Semaphore(JOB_PROCESS_WORKERS)
+    total = len(agencies) * len(formats)
+    done = 0
+
+    async def generate(agency: dict, file_format: str) -> dict:
+        nonlocal done
+        async with semaphore:
+            statement_file = await generate_statement_file(agency, period, file_format)
+        done += 1
+        await progress(int(done * 100 / total), f"{done}/{total} statements")
+        return statement_file
+
+    statement_files = await asyncio.gather(*(
+        generate(agency, file_format) for agency in agencies for file_format in formats
+    ))
+    return {
+        "period": period,
+        "agencies": len(agencies),
+        "rendered": sum(1 for statement_file in statement_files if not statement_file["cached"]),
+        "cached": sum(1 for statement_file in statement_files if statement_file["cached"]),
+        "files": [
+            {k: statement_file[k] for k in ("agency_id", "format", "data_version", "rows")}
+            for statement_file in statement_files
+        ]
+    }
+
+@api_router.get("/users/{user_id}/statements/{period}")
+async def get_monthly_statement(
+    user_id: str,
+    period: str,
+    format: str = "pdf",
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] == "sub_agency" and current_user["id"] != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if format not in STATEMENT_FILE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported format, expected pdf or xlsx")
+
+    agency = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1, "agency_name": 1})
+    if not agency:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    statement_file = await generate_statement_file(agency, period, format)
+    return FileResponse(
+        path=statement_file["file"],
+        filename=statement_file["filename"],
+        media_type=STATEMENT_FILE_MEDIA_TYPES[format],
+        headers={"X-Statement-Version": statement_file["data_version"]}
+    )
+
+# Archive
+def archive_cutoff(today: date, months: int) -> str:
+    month_index = today.year * 12 + today.month - 1 - months
+    return date(month_index // 12, month_index % 12 + 1, 1).isoformat()
+
+def archivable_reservations_query(cutoff: str) -> dict:
+    # Fully paid in the sense of compute_payment_status, so the balance no longer moves
+    return {**date_range_query("date_of_service", {"$lt": cutoff}), "rest_amount_of_payment": {"$in": [0, None]}}
+
+def archivable_requests_query(cutoff: str) -> dict:
+    return {
+        "check_out": {"$lt": cutoff},
+        "$or": [
+            {"reservation_status": "cancelled"},
+            {"reservation_status": "confirmed", "payment_status": "paid"}
+        ]
+    }
+
+async def move_to_archive(name: str, docs: List[dict]) -> List[str]:
+    source, target = db[name], db[f"{name}_archive"]
+    # The batch is recorded first so a run that dies half way is settled by the next one
+    batch = {
+        "id": str(uuid.uuid4()),
+        "collection": name,
+        "ids": [doc["id"] for doc in docs],
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.archive_batches.insert_one(dict(batch))
+    
+    await target.bulk_write([ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in docs], ordered=False)
+    # A document written since it was read stays live and is picked up by a later run
+    await source.bulk_write(
+        [DeleteOne({"id": doc["id"], "updated_at": doc.get("updated_at")}) for doc in docs],
+        ordered=False
+    )
+    return await settle_archive_batch(batch)
+
+async def settle_archive_batch(batch: dict) -> List[str]:
+    source, target = db[batch["collection"]], db[f"{batch['collection']}_archive"]
+    
+    # Anything still live must not also be in the archive, or lists and the ledger would count it twice
+    live = await source.find({"id": {"$in": batch["ids"]}}, {"_id": 0, "id": 1}).to_list(length=None)
+    live_ids = {doc["id"] for doc in live}
+    if live_ids:
+        await target.delete_many({"id": {"$in": list(live_ids)}})
+    archived_ids = [doc_id for doc_id in batch["ids"] if doc_id not in live_ids]
+    
+    if batch["collection"] in SYNC_COLLECTIONS and archived_ids:
+        # Archived records leave every default list, so sync clients drop them like deletions
+        archived = await target.find({"id": {"$in": archived_ids}}, {"_id": 0, "id": 1, "agency_id": 1}).to_list(length=None)
+        await record_tombstones(batch["collection"], archived, reason="archived")
+    
+    if batch["collection"] == "requests" and archived_ids:
+        # Comments and documents follow their request; none can be added once it has left the live collection
+        for child in ("comments", "documents"):
+            while True:
+                children = await db[child].find(
+                    {"request_id": {"$in": archived_ids}}, {"_id": 0}
+                ).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+                if not children or not await move_to_archive(child, children):
+                    break
+    
+    await db.archive_batches.delete_one({"id": batch["id"]})
+    return archived_ids
+
+async def archive_collection(name: str, query: dict) -> int:
+    moved = 0
+    while True:
+        docs = await db[name].find(query, {"_id": 0}).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not docs:
+            break
+        archived_ids = await move_to_archive(name, docs)
+        if not archived_ids:
+            break
+        moved += len(archived_ids)
+    return moved
+
+async def archive_old_records(months: int = ARCHIVE_AFTER_MONTHS) -> dict:
+    cutoff = archive_cutoff(datetime.now(timezone.utc).date(), months)
+    
+    for batch in await db.archive_batches.find({}, {"_id": 0}).to_list(length=None):
+        await settle_archive_batch(batch)
+    
+    result = {
+        "cutoff": cutoff,
+        "reservations": await archive_collection("reservations", archivable_reservations_query(cutoff)),
+        "requests": await archive_collection("requests", archivable_requests_query(cutoff))
+    }
+    if result["reservations"]:
+        invalidate_reservation_counts()
+        await invalidate_response_cache("reservations")
+    if result["reservations"] or result["requests"]:
+        logger.info(f"Archived {result['reservations']} reservations and {result['requests']} requests before {cutoff}")
+    return result
+
+@job_type("archive")
+async def archive_job(job: dict, progress):
+    return await archive_old_records(int(job["params"].get("months", ARCHIVE_AFTER_MONTHS)))
+
+# Email delivery
+class FileEmailSender:
+    # Local stand-in for SMTP: every message lands in a directory as an .eml file
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def deliver(self, message: EmailMessage):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex}.eml"
+        path.write_bytes(message.as_bytes())
+
+    async def send(self, message: EmailMessage):
+        await asyncio.to_thread(self.deliver, message)
+
+class SmtpEmailSender:
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.use_ssl = parsed.scheme == "smtps"
+        self.host = parsed.hostname
+        self.port = parsed.port or (465 if self.use_ssl else 587)
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+
+    def deliver(self, message: EmailMessage):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        with smtp_class(self.host, self.port, timeout=30) as smtp:
+            if not self.use_ssl:
+                smtp.ehlo()
+                if smtp.has_extn("starttls"):
+                    smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(message)
+
+    async def send(self, message: EmailMessage):
+        await asyncio.to_thread(self.deliver, message)
+
+def create_email_sender(url: str):
+    if url.startswith(("smtp://", "smtps://")):
+        return SmtpEmailSender(url)
+    if url.startswith("file://"):
+        return FileEmailSender(Path(urlparse(url).path))
+    raise ValueError(f"Unsupported EMAIL_SENDER_URL: {url}")
+
+email_sender = create_email_sender(EMAIL_SENDER_URL)
+
+# Payment alerts
+PAYMENT_ALERT_ITEM_FIELDS = ("id", "service_type", "tourist_names", "date_of_service", "last_date_of_payment", "rest_amount_of_payment")
+
+async def scan_payment_alerts() -> dict:
+    settings = await db.settings.find_one({"id": "default"}, {"_id": 0}) or {}
+    threshold_days = settings.get("upcoming_due_threshold_days", 7)
+    today = datetime.now(timezone.utc).date()
+    due_before = (today + timedelta(days=threshold_days + 1)).isoformat()
+    overdue_since = (today - timedelta(days=PAYMENT_ALERT_OVERDUE_DAYS)).isoformat()
+    
+    # One bounded range query over the (rest_amount_of_payment, last_date_of_payment) index, so the work
+    # per scan does not grow with the backlog of long-overdue items
+    query = {
+        "rest_amount_of_payment": {"$gt": 0},
+        **date_range_query("last_date_of_payment", {"$gte": overdue_since, "$lt": due_before})
+    }
+    projection = {"_id": 0, "agency_id": 1, "agency_name": 1, **{field: 1 for field in PAYMENT_ALERT_ITEM_FIELDS}}
+    reservations = await db.reservations.find(query, projection).to_list(length=None)
+    
+    candidates = []
+    for reservation in reservations:
+        due = parse_stored_date(reservation.get("last_date_of_payment"))
+        if due is None or not reservation.get("agency_id"):
+            continue
+        kind = "overdue" if due.date() < today else "upcoming"
+        candidates.append((reservation, kind))
+    
+    # An item is alerted once per kind and due date; moving the due date makes it eligible again
+    now = datetime.now(timezone.utc).isoformat()
+    alerts = [
+        {"reservation_id": r["id"], "kind": kind, "due_date": r["last_date_of_payment"], "created_at": now}
+        for r, kind in candidates
+    ]
+    existing = set()
+    if alerts:
+        found = await db.payment_alerts.find(
+            {"reservation_id": {"$in": [a["reservation_id"] for a in alerts]}},
+            {"_id": 0, "reservation_id": 1, "kind": 1, "due_date": 1}
+        ).to_list(length=None)
+        existing = {(a["reservation_id"], a["kind"], a["due_date"]) for a in found}
+    new_items = [
+        (candidate, alert) for candidate, alert in zip(candidates, alerts)
+        if (alert["reservation_id"], alert["kind"], alert["due_date"]) not in existing
+    ]
+    
+    digests: Dict[str, dict] = {}
+    for (reservation, kind), alert in new_items:
+        digest = digests.setdefault(reservation["agency_id"], {
+            "id": str(uuid.uuid4()),
+            "type": "payment_digest",
+            "agency_id": reservation["agency_id"],
+            "agency_name": reservation.get("agency_name", ""),
+            "overdue": [],
+            "upcoming": [],
+            "created_at": now,
+            "email_status": "pending",
+            "email_attempts": 0,
+            "email_error": None
+        })
+        digest[kind].append({field: reservation.get(field) for field in PAYMENT_ALERT_ITEM_FIELDS})
+        alert["notification_id"] = digest["id"]
+    
+    # Notifications go first: if the scan stops in between, the next one alerts those items again
+    # instead of having recorded them as alerted without telling anyone
+    if digests:
+        await db.notifications.insert_many([dict(digest) for digest in digests.values()])
+    
+    # The unique index decides which scan alerts an item if two ever overlap; the loser withdraws it
+    rejected = []
+    if new_items:
+        try:
+            await db.payment_alerts.insert_many([dict(alert) for _, alert in new_items], ordered=False)
+        except BulkWriteError as e:
+            rejected = [new_items[error["index"]] for error in e.details.get("writeErrors", [])]
+    for (reservation, kind), alert in rejected:
+        digest = digests[reservation["agency_id"]]
+        digest[kind] = [item for item in digest[kind] if item["id"] != reservation["id"]]
+        await db.notifications.update_one({"id": digest["id"]}, {"$pull": {kind: {"id": reservation["id"]}}})
+    for agency_id in [agency_id for agency_id, d in digests.items() if not d["overdue"] and not d["upcoming"]]:
+        await db.notifications.delete_one({"id": digests.pop(agency_id)["id"]})
+    
+    sent = await send_pending_notifications()
+    
+    return {
+        "candidates": len(candidates),
+        "alerted": sum(len(d["overdue"]) + len(d["upcoming"]) for d in digests.values()),
+        "notifications": len(digests),
+        "emails_sent": sent
+    }
+
+def build_digest_email(notification: dict, recipient: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = EMAIL_FROM
+    message["To"] = recipient
+    message["Subject"] = (
+        f"Payment reminder: {len(notification['overdue'])} overdue, {len(notification['upcoming'])} due soon"
+    )
+    lines = [f"Dear {notification.get('agency_name') or 'partner'},", ""]
+    for kind, title in (("overdue", "Overdue payments"), ("upcoming", "Payments due soon")):
+        if notification[kind]:
+            lines.append(f"{title}:")
+            for item in notification[kind]:
+                lines.append(
+                    f"  {item.get('last_date_of_payment')}  {item.get('rest_amount_of_payment')}  "
+                    f"{item.get('service_type') or ''}: {item.get('tourist_names') or ''}"
+                )
+            lines.append("")
+    lines.append("4Travels B2B")
+    message.set_content("\n".join(lines))
+    return message
+
+async def claim_notification() -> Optional[dict]:
+    # Claimed before sending so two scans never email the same digest; a claim left by a crashed worker goes stale
+    now = datetime.now(timezone.utc)
+    stale_before = (now - timedelta(seconds=PAYMENT_ALERT_EMAIL_CLAIM_SECONDS)).isoformat()
+    return await db.notifications.find_one_and_update(
+        {
+            "$or": [
+                {"email_status": {"$in": ["pending", "failed"]}},
+                {"email_status": "sending", "email_claimed_at": {"$lt": stale_before}}
+            ],
+            "email_attempts": {"$lt": PAYMENT_ALERT_EMAIL_ATTEMPTS}
+        },
+        {"$set": {"email_status": "sending", "email_claimed_at": now.isoformat()}, "$inc": {"email_attempts": 1}},
+        projection={"_id": 0},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def send_pending_notifications() -> int:
+    # Also retries digests whose email failed on an earlier scan
+    emails: Dict[str, Optional[str]] = {}
+    sent = 0
+    while True:
+        notification = await claim_notification()
+        if notification is None:
+            return sent
+        
+        agency_id = notification["agency_id"]
+        if agency_id not in emails:
+            agency = await db.users.find_one({"id": agency_id}, {"_id": 0, "email": 1})
+            emails[agency_id] = agency.get("email") if agency else None
+        email = emails[agency_id]
+        
+        if not email:
+            update = {"email_status": "skipped", "email_error": "Agency has no email address"}
+        else:
+            try:
+                await email_sender.send(build_digest_email(notification, email))
+                update = {"email_status": "sent", "email_error": None, "emailed_at": datetime.now(timezone.utc).isoformat()}
+                sent += 1
+            except Exception as e:
+                logger.warning(f"Payment digest email to {email} failed: {e}")
+                update = {"email_status": "failed", "email_error": str(e)}
+        await db.notifications.update_one({"id": notification["id"], "email_status": "sending"}, {"$set": update})
+
+@job_type("payment_alerts")
+async def payment_alerts_job(job: dict, progress):
+    return await scan_payment_alerts()
+
+@api_router.get("/notifications")
+async def get_notifications(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_user)
+):
+    query = {}
+    if current_user["role"] == "sub_agency":
+        query["agency_id"] = current_user["id"]
+    
+    skip = (page - 1) * limit
+    total, notifications = await asyncio.gather(
+        db.notifications.count_documents(query),
+        db.notifications.find(query, {"_id": 0}).sort([("created_at", -1), ("id", -1)]).skip(skip).limit(limit).to_list(limit)
+    )
+    return {
+        "notifications": notifications,
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "pages": (total + limit - 1) // limit
+    }
+
+# Native date migration
+async def start_native_dates_migration():
+    await refresh_native_dates_ready()
+    if native_dates_ready:
+        return
+    pending = await db.jobs.find_one(
+        {"type": "native_dates_migration", "status": {"$in": ["queued", "running"]}},
+        {"_id": 0, "id": 1}
+    )
+    if not pending:
+        await enqueue_job("native_dates_migration", {})
+
+async def migrate_native_dates(progress) -> dict:
+    global native_dates_ready
+    state = await db.migrations.find_one({"_id": "native_dates"}) or {}
+    checkpoints = state.get("checkpoints", {})
+    migrated = {}
+    
+    for index, (name, fields) in enumerate(DATE_FIELDS.items()):
+        collection = db[name]
+        last_id = checkpoints.get(name)
+        migrated[name] = 0
+        while True:
+            # Walks _id order from the last checkpoint, so a restarted run resumes where it stopped
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            docs = await collection.find(query, {field: 1 for field in fields}).sort("_id", 1).limit(
+                DATE_MIGRATION_BATCH_SIZE
+            ).to_list(DATE_MIGRATION_BATCH_SIZE)
+            if not docs:
+                break
+            
+            # One guarded $set per field: a write that changed the field since it was read has set its date itself
+            await collection.bulk_write([
+                UpdateOne(
+                    {"_id": doc["_id"], field: doc.get(field)},
+                    {"$set": {f"dates.{field}": parse_stored_date(doc.get(field))}}
+                )
+                for doc in docs for field in fields
+            ], ordered=False)
+            
+            last_id = docs[-1]["_id"]
+            migrated[name] += len(docs)
+            await db.migrations.update_one(
+                {"_id": "native_dates"},
+                {"$set": {f"checkpoints.{name}": last_id, "updated_at": datetime.now(timezone.utc).isoformat()}},
+                upsert=True
+            )
+        await progress(int((index + 1) * 100 / len(DATE_FIELDS)), f"{name}: {migrated[name]} documents")
+    
+    await db.migrations.update_one(
+        {"_id": "native_dates"},
+        {"$set": {"completed_at": datetime.now(timezone.utc).isoformat(), "collections": list(DATE_FIELDS)}},
+        upsert=True
+    )
+    native_dates_ready = True
+    invalidate_reservation_counts()
+    return migrated
+
+@job_type("native_dates_migration")
+async def native_dates_migration_job(job: dict, progress):
+    return await migrate_native_dates(progress)
+
+def job_public_view(job: dict) -> dict:
+    view = {k: v for k, v in job.items() if k not in ("_id", "lease_owner", "slot", "result_file")}
+    for field in ("lease_expires_at", "run_after"):
+        if isinstance(view.get(field), datetime):
+            view[field] = view[field].isoformat()
+    view["has_file"] = bool(job.get("result_file"))
+    return view
+
+async def get_visible_job(job_id: str, user: dict) -> dict:
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if user["role"] != "admin" and job.get("created_by") != user["id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return job
+
+@api_router.post("/jobs")
+async def create_job(job_data: JobCreate, admin: dict = Depends(require_admin)):
+    job = await enqueue_job(job_data.type, job_data.params, created_by=admin["id"])
+    return job_public_view(job)
+
+@api_router.get("/jobs")
+async def get_jobs(
+    job_status: Optional[str] = Query(None, alias="status"),
+    job_type_name: Optional[str] = Query(None, alias="type"),
+    limit: int = 50,
+    admin: dict = Depends(require_admin)
+):
+    query = {}
+    if job_status:
+        query["status"] = job_status
+    if job_type_name:
+        query["type"] = job_type_name
+    jobs = await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+    return [job_public_view(job) for job in jobs]
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    return job_public_view(await get_visible_job(job_id, current_user))
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await get_visible_job(job_id, current_user)
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    
+    if job.get("result_file"):
+        file_path = Path(job["result_file"])
+        if not file_path.exists():
+            raise HTTPException(status_code=404, detail="File not found")
+        return FileResponse(
+            path=file_path,
+            filename=job.get("result_filename") or file_path.name,
+            media_type='application/octet-stream'
+        )
+    return job.get("result") or {}
+
 app.include_router(api_router)
 
+# Response compression
+# Downloads are served as octet-stream, xlsx or pdf and are left alone since they are binary or already compressed
+COMPRESSIBLE_MEDIA_TYPES = {"application/json", "application/javascript", "application/xml", "image/svg+xml"}
+
+def choose_content_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        if self.encoding == "br":
+            output = self.compressor.process(data) if data else b""
+            return output + self.compressor.finish() if finish else output
+        output = self.compressor.compress(data)
+        return output + self.compressor.flush() if finish else output
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_content_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+        
+        start_message = None
+        compressor = None
+        passthrough = False
+        
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            
+            if compressor is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+                compressible = media_type.startswith("text/") or media_type in COMPRESSIBLE_MEDIA_TYPES
+                if "content-encoding" in headers or not compressible or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                
+                compressor = StreamCompressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    # Streamed exports are compressed chunk by chunk
+                    del headers["Content-Length"]
+                else:
+                    body = compressor.compress(body, finish=True)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start_message)
+            
+            chunk = compressor.compress(body, finish=not more_body)
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        
+        await self.app(scope, receive, send_compressed)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1290,6 +4313,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -1298,4 +4324,8 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    if process_pool is not None:
+        process_pool.shutdown(wait=False)
     client.close()
\ No newline at end of file
@@ -19,6 +19,48 @@ export const AuthProvider = ({ children }) => {
     }
   }, [token]);
 
+  useEffect(() => {
+    // Access tokens are short-lived: on a 401, rotate the refresh token once and retry.
+    // Only login and refresh themselves are exempt, so an expired token on /auth/me still refreshes
+    let refreshing = null;
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem('refreshToken');
+        if (
+          error.response?.status !== 401 ||
+          !original ||
+          original._retried ||
+          !refreshToken ||
+          /\/auth\/(login|refresh)$/.test(original.url || '')
+        ) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+          refreshing = refreshing || axios
+            .post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+            .finally(() => { refreshing = null; });
+          const { data } = await refreshing;
+          applyTokens(data.access_token, data.refresh_token);
+          original.headers['Authorization'] = `Bearer ${data.access_token}`;
+          return axios(original);
+        } catch (refreshError) {
+          logout();
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
+  const applyTokens = (accessToken, refreshToken) => {
+    localStorage.setItem('token', accessToken);
+    localStorage.setItem('refreshToken', refreshToken);
+    axios.defaults.headers.common['Authorization'] = `Bearer ${accessToken}`;
+  };
+
   const fetchCurrentUser = async () => {
     try {
       const response = await axios.get(`${API}/auth/me`);
@@ -33,11 +75,10 @@ export const AuthProvider = ({ children }) => {
 
   const login = async (email, password) => {
     const response = await axios.post(`${API}/auth/login`, { email, password });
-    const { access_token, user: userData } = response.data;
+    const { access_token, refresh_token, user: userData } = response.data;
+    applyTokens(access_token, refresh_token);
     setToken(access_token);
     setUser(userData);
-    localStorage.setItem('token', access_token);
-    axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
     return userData;
   };
 
@@ -45,14 +86,17 @@ export const AuthProvider = ({ children }) => {
     setUser(null);
     setToken(null);
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
     delete axios.defaults.headers.common['Authorization'];
   };
 
   const changePassword = async (oldPassword, newPassword) => {
-    await axios.post(`${API}/auth/change-password`, {
+    const response = await axios.post(`${API}/auth/change-password`, {
       old_password: oldPassword,
       new_password: newPassword
     });
+    // Changing the password revokes every earlier token, including this session's
+    applyTokens(response.data.access_token, response.data.refresh_token);
   };
 
   return (
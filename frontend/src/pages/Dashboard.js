@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { useAuth } from '../contexts/AuthContext';
@@ -68,34 +68,44 @@ const Dashboard = () => {
     supplier_prepayment_amount: ''
   });
 
+  const bootstrapped = useRef(false);
+
   useEffect(() => {
-    fetchReservations();
-    fetchStatistics();
-    fetchSettings();
-    fetchTotalExpenses();
-    fetchThisMonthStats();
-    if (user?.role === 'admin') {
-      fetchAgencies();
-      fetchSuppliers();
-      fetchTouristNames();
+    // The first load fetches every dashboard section in one request, filter changes only reload the table
+    if (!bootstrapped.current) {
+      bootstrapped.current = true;
+      fetchBootstrap();
+      fetchThisMonthStats();
+      return;
     }
+    fetchReservations();
   }, [page, search, serviceType, paymentStatus]);
 
-  const fetchSettings = async () => {
-    try {
-      const response = await axios.get(`${API}/settings`);
-      setThresholdDays(response.data.upcoming_due_threshold_days || 7);
-    } catch (error) {
-      console.error('Failed to fetch settings:', error);
-    }
+  const reservationParams = () => {
+    const params = { page, limit: 25 };
+    if (search) params.search = search;
+    if (serviceType && serviceType !== 'all') params.service_type = serviceType;
+    if (paymentStatus && paymentStatus !== 'all') params.payment_status = paymentStatus;
+    return params;
   };
 
-  const fetchTotalExpenses = async () => {
+  const fetchBootstrap = async () => {
     try {
-      const response = await axios.get(`${API}/expenses/total`);
-      setTotalExpenses(response.data.total || 0);
+      setLoading(true);
+      const { data } = await axios.get(`${API}/bootstrap`, { params: reservationParams() });
+      setReservations(data.reservations.reservations);
+      setTotal(data.reservations.total);
+      setTotalPages(data.reservations.pages);
+      setStatistics(data.statistics);
+      setThresholdDays(data.settings.upcoming_due_threshold_days || 7);
+      setTotalExpenses(data.expenses_total.total || 0);
+      if (data.users) setAgencies(data.users.filter(u => u.role === 'sub_agency'));
+      if (data.suppliers) setSuppliers(data.suppliers);
+      if (data.tourist_names) setTouristNames(data.tourist_names.names || []);
     } catch (error) {
-      console.error('Failed to fetch expenses:', error);
+      toast.error(t('common.error'));
+    } finally {
+      setLoading(false);
     }
   };
 
@@ -108,7 +118,10 @@ const Dashboard = () => {
 
       // Fetch all reservations for this month (without pagination)
       const response = await axios.get(`${API}/reservations`, { 
-        params: { limit: 10000 } // Large limit to get all
+        params: {
+          limit: 10000, // Large limit to get all
+          fields: 'date_of_issue,price,prepayment_amount,rest_amount_of_payment'
+        }
       });
       
       const thisMonthReservations = response.data.reservations.filter(r => {
@@ -155,24 +168,6 @@ const Dashboard = () => {
   };
 
 
-  const fetchAgencies = async () => {
-    try {
-      const response = await axios.get(`${API}/users`);
-      setAgencies(response.data.filter(u => u.role === 'sub_agency'));
-    } catch (error) {
-      console.error('Failed to fetch agencies:', error);
-    }
-  };
-
-  const fetchSuppliers = async () => {
-    try {
-      const response = await axios.get(`${API}/suppliers`);
-      setSuppliers(response.data);
-    } catch (error) {
-      console.error('Failed to fetch suppliers:', error);
-    }
-  };
-
   const fetchTouristNames = async () => {
     try {
       const response = await axios.get(`${API}/tourist-names`);
@@ -185,12 +180,8 @@ const Dashboard = () => {
   const fetchReservations = async () => {
     try {
       setLoading(true);
-      const params = { page, limit: 25 };
-      if (search) params.search = search;
-      if (serviceType && serviceType !== 'all') params.service_type = serviceType;
-      if (paymentStatus && paymentStatus !== 'all') params.payment_status = paymentStatus;
-
-      const response = await axios.get(`${API}/reservations`, { params });
+      // The table only shows the slim list columns
+      const response = await axios.get(`${API}/reservations`, { params: { ...reservationParams(), view: 'list' } });
       setReservations(response.data.reservations);
       setTotal(response.data.total);
       setTotalPages(response.data.pages);
@@ -264,7 +255,17 @@ const Dashboard = () => {
     }
   };
 
-  const exportToCSV = () => {
+  const exportToCSV = async () => {
+    // The table rows are the slim list view; the export also needs the descriptions
+    let exported;
+    try {
+      const response = await axios.get(`${API}/reservations`, { params: { ...reservationParams(), view: 'full' } });
+      exported = response.data.reservations;
+    } catch (error) {
+      toast.error(t('common.error'));
+      return;
+    }
+
     const headers = [
       t('columns.id'),
       t('columns.agency'),
@@ -291,7 +292,7 @@ const Dashboard = () => {
       );
     }
 
-    const rows = reservations.map((r, idx) => {
+    const rows = exported.map((r, idx) => {
       const row = [
         idx + 1,
         r.agency_name,
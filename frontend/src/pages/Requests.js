@@ -22,13 +22,17 @@ const COUNTRIES = ['Россия', 'Турция', 'ОАЭ', 'Египет', 'Т
 const FLIGHT_CLASSES = ['economy', 'business', 'first'];
 const HOTEL_CATEGORIES = [1, 2, 3, 4, 5];
 const MEAL_TYPES = ['BB', 'HB', 'FB', 'AI', 'UAI'];
+const PAGE_SIZE = 50;
 
 const Requests = () => {
   const { t } = useI18n();
   const navigate = useNavigate();
   const { user } = useAuth();
   const [requests, setRequests] = useState([]);
-  const [filteredRequests, setFilteredRequests] = useState([]);
+  const [statusCounts, setStatusCounts] = useState({});
+  const [page, setPage] = useState(1);
+  const [total, setTotal] = useState(0);
+  const [totalPages, setTotalPages] = useState(1);
   const [loading, setLoading] = useState(true);
   const [showDialog, setShowDialog] = useState(false);
   
@@ -59,37 +63,32 @@ const Requests = () => {
   const [selectedFiles, setSelectedFiles] = useState([]);
 
   useEffect(() => {
-    if (user) {
-      fetchRequests();
-    }
-  }, [user]);
-
-  useEffect(() => {
-    applyFilters();
-  }, [requests, filterCountry, filterReservationStatus, filterPaymentStatus]);
-
-  const applyFilters = () => {
-    let filtered = [...requests];
-
-    if (filterCountry !== 'all') {
-      filtered = filtered.filter(req => req.country === filterCountry);
-    }
-
-    if (filterReservationStatus !== 'all') {
-      filtered = filtered.filter(req => req.reservation_status === filterReservationStatus);
-    }
-
-    if (filterPaymentStatus !== 'all') {
-      filtered = filtered.filter(req => req.payment_status === filterPaymentStatus);
-    }
+    if (!user) return;
+    // A response for an earlier page or filter that arrives late must not overwrite the current one
+    let cancelled = false;
+    fetchRequests(() => cancelled);
+    return () => { cancelled = true; };
+  }, [user, page, filterCountry, filterReservationStatus, filterPaymentStatus]);
 
-    setFilteredRequests(filtered);
+  // Changing a filter goes back to the first page in the same render, so only one request is sent
+  const changeFilter = (setFilter) => (value) => {
+    setFilter(value);
+    setPage(1);
   };
 
-  const fetchRequests = async () => {
+  const fetchRequests = async (isCancelled = () => false) => {
     try {
-      const response = await axios.get(`${API}/requests`);
-      setRequests(response.data);
+      const params = { page, limit: PAGE_SIZE };
+      if (filterCountry !== 'all') params.country = filterCountry;
+      if (filterReservationStatus !== 'all') params.reservation_status = filterReservationStatus;
+      if (filterPaymentStatus !== 'all') params.payment_status = filterPaymentStatus;
+
+      const response = await axios.get(`${API}/requests`, { params });
+      if (isCancelled()) return;
+      setRequests(response.data.requests);
+      setStatusCounts(response.data.counts || {});
+      setTotal(response.data.total);
+      setTotalPages(response.data.pages);
       setLoading(false);
     } catch (error) {
       console.error('Error fetching requests:', error);
@@ -97,6 +96,11 @@ const Requests = () => {
     }
   };
 
+  const withCount = (label, field, value) => {
+    const count = statusCounts[field]?.[value];
+    return count ? `${label} (${count})` : label;
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
@@ -426,7 +430,7 @@ const Requests = () => {
           <div className="flex flex-col md:flex-row gap-4">
             <div className="flex-1">
               <Label className="text-sm text-gray-600 mb-2">{t('requests.country')}</Label>
-              <Select value={filterCountry} onValueChange={setFilterCountry}>
+              <Select value={filterCountry} onValueChange={changeFilter(setFilterCountry)}>
                 <SelectTrigger className="w-full">
                   <SelectValue placeholder={t('serviceTypes.all')} />
                 </SelectTrigger>
@@ -441,32 +445,32 @@ const Requests = () => {
             
             <div className="flex-1">
               <Label className="text-sm text-gray-600 mb-2">{t('requests.reservationStatus')}</Label>
-              <Select value={filterReservationStatus} onValueChange={setFilterReservationStatus}>
+              <Select value={filterReservationStatus} onValueChange={changeFilter(setFilterReservationStatus)}>
                 <SelectTrigger className="w-full">
                   <SelectValue placeholder={t('serviceTypes.all')} />
                 </SelectTrigger>
                 <SelectContent>
                   <SelectItem value="all">{t('serviceTypes.all')}</SelectItem>
-                  <SelectItem value="in_progress">{t('requests.inProgress')}</SelectItem>
-                  <SelectItem value="booked">{t('requests.booked')}</SelectItem>
-                  <SelectItem value="confirmed">{t('requests.confirmed')}</SelectItem>
-                  <SelectItem value="cancelled">{t('requests.cancelled')}</SelectItem>
+                  <SelectItem value="in_progress">{withCount(t('requests.inProgress'), 'reservation_status', 'in_progress')}</SelectItem>
+                  <SelectItem value="booked">{withCount(t('requests.booked'), 'reservation_status', 'booked')}</SelectItem>
+                  <SelectItem value="confirmed">{withCount(t('requests.confirmed'), 'reservation_status', 'confirmed')}</SelectItem>
+                  <SelectItem value="cancelled">{withCount(t('requests.cancelled'), 'reservation_status', 'cancelled')}</SelectItem>
                 </SelectContent>
               </Select>
             </div>
             
             <div className="flex-1">
               <Label className="text-sm text-gray-600 mb-2">{t('requests.paymentStatus')}</Label>
-              <Select value={filterPaymentStatus} onValueChange={setFilterPaymentStatus}>
+              <Select value={filterPaymentStatus} onValueChange={changeFilter(setFilterPaymentStatus)}>
                 <SelectTrigger className="w-full">
                   <SelectValue placeholder={t('serviceTypes.all')} />
                 </SelectTrigger>
                 <SelectContent>
                   <SelectItem value="all">{t('serviceTypes.all')}</SelectItem>
-                  <SelectItem value="awaiting_payment">{t('requests.awaitingPayment')}</SelectItem>
-                  <SelectItem value="paid">{t('requests.paid')}</SelectItem>
-                  <SelectItem value="partially_paid">{t('requests.partiallyPaid')}</SelectItem>
-                  <SelectItem value="not_paid">{t('requests.notPaid')}</SelectItem>
+                  <SelectItem value="awaiting_payment">{withCount(t('requests.awaitingPayment'), 'payment_status', 'awaiting_payment')}</SelectItem>
+                  <SelectItem value="paid">{withCount(t('requests.paid'), 'payment_status', 'paid')}</SelectItem>
+                  <SelectItem value="partially_paid">{withCount(t('requests.partiallyPaid'), 'payment_status', 'partially_paid')}</SelectItem>
+                  <SelectItem value="not_paid">{withCount(t('requests.notPaid'), 'payment_status', 'not_paid')}</SelectItem>
                 </SelectContent>
               </Select>
             </div>
@@ -494,14 +498,14 @@ const Requests = () => {
                       {t('common.loading')}
                     </TableCell>
                   </TableRow>
-                ) : filteredRequests.length === 0 ? (
+                ) : requests.length === 0 ? (
                   <TableRow>
                     <TableCell colSpan={user.role === 'admin' ? 7 : 6} className="text-center py-8">
                       {t('common.noData')}
                     </TableCell>
                   </TableRow>
                 ) : (
-                  filteredRequests.map((request, idx) => (
+                  requests.map((request, idx) => (
                     <TableRow
                       key={request.id}
                       className={`cursor-pointer ${idx % 2 === 0 ? 'bg-white' : 'bg-blue-50/50 hover:bg-blue-100/50'}`}
@@ -531,6 +535,33 @@ const Requests = () => {
               </TableBody>
             </Table>
           </div>
+
+          {/* Pagination */}
+          {totalPages > 1 && (
+            <div className="flex items-center justify-between mt-4">
+              <div className="text-sm text-gray-600">
+                {t('dashboard.showing')} {(page - 1) * PAGE_SIZE + 1}-{Math.min(page * PAGE_SIZE, total)} {t('dashboard.of')} {total}
+              </div>
+              <div className="flex gap-2">
+                <Button
+                  variant="outline"
+                  size="sm"
+                  onClick={() => setPage(p => Math.max(1, p - 1))}
+                  disabled={page === 1}
+                >
+                  {t('common.previous')}
+                </Button>
+                <Button
+                  variant="outline"
+                  size="sm"
+                  onClick={() => setPage(p => Math.min(totalPages, p + 1))}
+                  disabled={page === totalPages}
+                >
+                  {t('common.next')}
+                </Button>
+              </div>
+            </div>
+          )}
         </div>
       </div>
       )}
@@ -246,7 +246,9 @@ export const translations = {
       loading: 'Загрузка...',
       noData: 'Нет данных',
       createdAt: 'Дата создания',
-      actions: 'Действия'
+      actions: 'Действия',
+      previous: 'Назад',
+      next: 'Далее'
     }
   },
   en: {
@@ -495,7 +497,9 @@ export const translations = {
       loading: 'Loading...',
       noData: 'No Data',
       createdAt: 'Date Created',
-      actions: 'Actions'
+      actions: 'Actions',
+      previous: 'Previous',
+      next: 'Next'
     }
   }
 };
\ No newline at end of file
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import time
+import uuid
+from typing import List
+
+import orjson
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+# server.py reads these at import time; no database connection is made
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "serialization_benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from server import UserResponse, TopUpResponse, RequestResponse, model_list_json  # noqa: E402
+
+ROWS = int(os.environ.get("BENCHMARK_ROWS", "10000"))
+REPEAT = int(os.environ.get("BENCHMARK_REPEAT", "5"))
+
+def user_row(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "agency_name": f"Agency {i}",
+        "email": f"agency{i}@example.com",
+        "phone": "+30 210 000 0000",
+        "role": "sub_agency",
+        "is_active": True,
+        "locale": "en",
+        "created_at": "2026-01-01T10:00:00+00:00",
+        "balance": 1234.56 + i,
+        "last_balance_topup": 100.0
+    }
+
+def topup_row(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "agency_id": str(uuid.uuid4()),
+        "agency_name": f"Agency {i}",
+        "amount": 250.0 + i,
+        "type": "cash",
+        "date": "2026-01-01T10:00:00+00:00",
+        "created_at": "2026-01-01T10:00:00+00:00"
+    }
+
+def request_row(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "agency_id": str(uuid.uuid4()),
+        "agency_name": f"Agency {i}",
+        "check_in": "2026-06-01",
+        "check_out": "2026-06-08",
+        "adults": 2,
+        "children": 1,
+        "child_ages": [7],
+        "infants": 0,
+        "flight_needed": True,
+        "flight_class": "economy",
+        "transfer_needed": False,
+        "country": "Greece",
+        "location": "Athens",
+        "hotel": None,
+        "hotel_category": 4,
+        "meal": "BB",
+        "description": "Family trip",
+        "target_price": 1500.0,
+        "reservation_status": "in_progress",
+        "payment_status": "awaiting_payment",
+        "document_status": "documents_not_ready",
+        "created_at": "2026-01-01T10:00:00+00:00",
+        "updated_at": "2026-01-01T10:00:00+00:00"
+    }
+
+def models_with_response_model(model, rows, response_class):
+    # What the list handlers did before: one model per row, then response_model validation
+    field = create_response_field(name="Response", type_=List[model])
+    content = [model(**row) for row in rows]
+    serialized = asyncio.run(serialize_response(field=field, response_content=content))
+    return response_class(serialized).body
+
+def type_adapter_json(model, rows, response_class):
+    return model_list_json(model, rows)
+
+def trusted_projection_orjson(model, rows, response_class):
+    # Upper bound: rows are trusted to match the model because of the projection
+    return orjson.dumps(rows)
+
+PATHS = [
+    ("models + response_model + JSONResponse", models_with_response_model, JSONResponse),
+    ("models + response_model + ORJSONResponse", models_with_response_model, ORJSONResponse),
+    ("TypeAdapter validate + dump_json", type_adapter_json, None),
+    ("trusted projection + orjson", trusted_projection_orjson, None),
+]
+
+def best_of(func, *args) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    datasets = [
+        ("UserResponse", UserResponse, [user_row(i) for i in range(ROWS)]),
+        ("TopUpResponse", TopUpResponse, [topup_row(i) for i in range(ROWS)]),
+        ("RequestResponse", RequestResponse, [request_row(i) for i in range(ROWS)]),
+    ]
+
+    print(f"Serializing {ROWS} rows, best of {REPEAT} runs\n")
+    for name, model, rows in datasets:
+        # Every path must produce the same document
+        expected = orjson.loads(models_with_response_model(model, rows, JSONResponse))
+        print(name)
+        baseline = None
+        for label, func, response_class in PATHS:
+            if func is not trusted_projection_orjson:
+                assert orjson.loads(func(model, rows, response_class)) == expected, label
+            elapsed = best_of(func, model, rows, response_class)
+            baseline = baseline or elapsed
+            print(f"  {label:<45} {elapsed * 1000:9.1f} ms  {baseline / elapsed:6.1f}x")
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import asyncio
+
+import server
+
+def set_balance(agency_id: str, balance: float):
+    asyncio.run(server.db.users.update_one({"id": agency_id}, {"$set": {"balance": balance}}))
+
+def stored_balance(agency_id: str) -> float:
+    return asyncio.run(server.db.users.find_one({"id": agency_id}))["balance"]
+
+def test_corrects_drifted_balances(client, admin, create_agency, monkeypatch):
+    agency = create_agency()
+    set_balance(agency["id"], 100.0)
+
+    async def ledger_totals(date_query):
+        return {agency["id"]: 80.0}
+    monkeypatch.setattr(server, "ledger_totals_by_agency", ledger_totals)
+
+    report = client.post("/api/balance-reconciliation", params={"correct": "true"}, headers=admin).json()
+
+    assert report["corrected"] == 1
+    assert report["discrepancies"][0]["difference"] == 20.0
+    assert stored_balance(agency["id"]) == 80.0
+
+def test_leaves_balances_that_change_during_the_check(client, admin, create_agency, monkeypatch):
+    agency = create_agency()
+    set_balance(agency["id"], 100.0)
+
+    async def ledger_totals_with_concurrent_topup(date_query):
+        # The balance has drifted by 20, and a top-up lands while the ledger is read
+        # with its balance change visible but not its entry
+        await server.db.users.update_one({"id": agency["id"]}, {"$inc": {"balance": 50.0}})
+        return {agency["id"]: 80.0}
+    monkeypatch.setattr(server, "ledger_totals_by_agency", ledger_totals_with_concurrent_topup)
+
+    report = client.post("/api/balance-reconciliation", params={"correct": "true"}, headers=admin).json()
+
+    assert report["corrected"] == 0 and report["discrepancies"] == []
+    assert report["changed_during_check"] == 1
+    assert stored_balance(agency["id"]) == 150.0
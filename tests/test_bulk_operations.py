@@ -0,0 +1,62 @@
+import asyncio
+
+import server
+
+def test_bulk_mark_paid_by_ids_reports_each_id(client, admin, create_agency, create_reservation):
+    agency = create_agency()
+    unpaid = create_reservation(agency["id"], prepayment_amount=30, rest_amount_of_payment=70)
+    paid = create_reservation(agency["id"], prepayment_amount=100, rest_amount_of_payment=0)
+    asyncio.run(server.db.reservations.update_one({"id": paid["id"]}, {"$set": {"actual_date_of_full_payment": "2026-02-01"}}))
+
+    response = client.post("/api/reservations/bulk-mark-paid", json={"ids": [unpaid["id"], paid["id"], "missing"]}, headers=admin)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["updated"] == 1 and body["skipped"] == 1 and body["not_found"] == 1
+    assert [result["status"] for result in body["results"]] == ["updated", "already_paid", "not_found"]
+    updated = asyncio.run(server.db.reservations.find_one({"id": unpaid["id"]}))
+    assert updated["prepayment_amount"] == 100 and updated["rest_amount_of_payment"] == 0
+    assert updated["actual_date_of_full_payment"]
+    untouched = asyncio.run(server.db.reservations.find_one({"id": paid["id"]}))
+    assert untouched["actual_date_of_full_payment"] == "2026-02-01"
+
+def test_bulk_mark_paid_filter_selects_only_unpaid(client, admin, create_agency, create_reservation):
+    agency = create_agency()
+    other = create_agency("other@example.com")
+    unpaid = create_reservation(agency["id"])
+    create_reservation(agency["id"], prepayment_amount=100, rest_amount_of_payment=0)
+    create_reservation(other["id"])
+
+    response = client.post("/api/reservations/bulk-mark-paid", json={"filter": {"agency_id": agency["id"]}}, headers=admin)
+
+    assert response.status_code == 200
+    assert response.json()["results"] == [{"id": unpaid["id"], "status": "updated"}]
+
+def test_bulk_operations_reject_empty_filters(client, admin):
+    for filter_body in ({}, {"agency_id": None, "search": ""}):
+        response = client.post("/api/reservations/bulk-mark-paid", json={"filter": filter_body}, headers=admin)
+        assert response.status_code == 400
+    response = client.post("/api/requests/bulk-update", json={"filter": {}, "document_status": "documents_ready"}, headers=admin)
+    assert response.status_code == 400
+
+def test_bulk_update_requests(client, admin, create_agency, create_request):
+    agency = create_agency()
+    first = create_request(agency["headers"])
+    second = create_request(agency["headers"])
+
+    response = client.post("/api/requests/bulk-update", json={
+        "ids": [first, "missing"],
+        "reservation_status": "confirmed"
+    }, headers=admin)
+    assert response.json()["results"] == [{"id": first, "status": "updated"}, {"id": "missing", "status": "not_found"}]
+
+    response = client.post("/api/requests/bulk-update", json={
+        "filter": {"agency_id": agency["id"], "reservation_status": "in_progress"},
+        "document_status": "documents_ready"
+    }, headers=admin)
+    assert [result["id"] for result in response.json()["results"]] == [second]
+
+def test_bulk_operations_require_admin(client, create_agency):
+    agency = create_agency()
+    response = client.post("/api/reservations/bulk-mark-paid", json={"ids": ["x"]}, headers=agency["headers"])
+    assert response.status_code == 403
@@ -0,0 +1,49 @@
+import server
+
+def test_unchanged_collection_returns_304(client, admin):
+    first = client.get("/api/suppliers", headers=admin)
+    etag = first.headers["ETag"]
+
+    response = client.get("/api/suppliers", headers={**admin, "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+def test_write_changes_etag(client, admin):
+    etag = client.get("/api/suppliers", headers=admin).headers["ETag"]
+    client.post("/api/suppliers", json={"name": "Hotel Group"}, headers=admin)
+
+    response = client.get("/api/suppliers", headers={**admin, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [supplier["name"] for supplier in response.json()] == ["Hotel Group"]
+
+def test_reservation_writes_invalidate_after_balance_update(client, admin, create_agency, create_reservation, monkeypatch):
+    agency = create_agency()
+    balances_at_invalidation = []
+    invalidate = server.invalidate_response_cache
+
+    async def recording_invalidate(*tags):
+        if "users" in tags:
+            user = await server.db.users.find_one({"id": agency["id"]})
+            balances_at_invalidation.append(user["balance"])
+        await invalidate(*tags)
+
+    monkeypatch.setattr(server, "invalidate_response_cache", recording_invalidate)
+    reservation = create_reservation(agency["id"], price=100.0)
+    client.put(f"/api/reservations/{reservation['id']}", json={"price": 150.0}, headers=admin)
+    client.delete(f"/api/reservations/{reservation['id']}", headers=admin)
+
+    # A /users read right after any invalidation must see the balance the write produced
+    assert balances_at_invalidation == [-100.0, -150.0, 0.0]
+
+def test_users_etag_reflects_new_balance(client, admin, create_agency, create_reservation):
+    agency = create_agency()
+    etag = client.get("/api/users", headers=admin).headers["ETag"]
+    create_reservation(agency["id"], price=40.0)
+
+    response = client.get("/api/users", headers={**admin, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert next(user for user in response.json() if user["id"] == agency["id"])["balance"] == -40.0
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+USER = {"id": "admin-1"}
+
+def agency_balance(agency_id: str) -> float:
+    return asyncio.run(server.db.users.find_one({"id": agency_id}))["balance"]
+
+def test_retried_topup_is_applied_once(client, admin, create_agency):
+    agency = create_agency()
+    headers = {**admin, "Idempotency-Key": "topup-1"}
+
+    first = client.post(f"/api/users/{agency['id']}/topup-balance", json={"amount": 50}, headers=headers)
+    retry = client.post(f"/api/users/{agency['id']}/topup-balance", json={"amount": 50}, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert agency_balance(agency["id"]) == 50
+
+def test_key_reused_for_a_different_request(client, admin, create_agency):
+    agency = create_agency()
+    headers = {**admin, "Idempotency-Key": "topup-1"}
+    client.post(f"/api/users/{agency['id']}/topup-balance", json={"amount": 50}, headers=headers)
+
+    response = client.post(f"/api/users/{agency['id']}/topup-balance", json={"amount": 70}, headers=headers)
+
+    assert response.status_code == 422
+    assert agency_balance(agency["id"]) == 50
+
+def test_failed_request_can_be_retried(client, admin, create_agency):
+    agency = create_agency()
+    headers = {**admin, "Idempotency-Key": "topup-1"}
+
+    assert client.post(f"/api/users/{agency['id']}/topup-balance", json={"amount": -5}, headers=headers).status_code == 400
+    assert client.post(f"/api/users/{agency['id']}/topup-balance", json={"amount": -5}, headers=headers).status_code == 400
+    assert asyncio.run(server.db.idempotency_keys.count_documents({})) == 0
+
+def test_slow_operation_keeps_its_lock(db, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_LOCK_SECONDS", 0.2)
+    monkeypatch.setattr(server, "IDEMPOTENCY_POLL_SECONDS", 0.02)
+    calls = []
+
+    async def charge():
+        calls.append(1)
+        await asyncio.sleep(0.6)
+        return {"charged": len(calls)}
+
+    async def scenario():
+        first = asyncio.create_task(server.run_idempotent("key", USER, "charge", {"amount": 1}, charge))
+        await asyncio.sleep(0.3)
+        # The first lock would have expired by now without renewal
+        retry = await server.run_idempotent("key", USER, "charge", {"amount": 1}, charge)
+        return await first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert calls == [1]
+    assert first == retry == {"charged": 1}
+
+def test_cancelled_operation_releases_the_key(db):
+    async def scenario():
+        task = asyncio.create_task(server.run_idempotent("key", USER, "charge", {"amount": 1}, lambda: asyncio.sleep(60)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await server.db.idempotency_keys.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+
+def test_concurrent_duplicate_gives_up_after_waiting(db, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_WAIT_SECONDS", 0.1)
+    monkeypatch.setattr(server, "IDEMPOTENCY_POLL_SECONDS", 0.02)
+
+    async def scenario():
+        first = asyncio.create_task(server.run_idempotent("key", USER, "charge", {"amount": 1}, lambda: asyncio.sleep(0.5)))
+        await asyncio.sleep(0.02)
+        with pytest.raises(HTTPException) as error:
+            await server.run_idempotent("key", USER, "charge", {"amount": 1}, lambda: asyncio.sleep(0))
+        await first
+        return error.value.status_code
+
+    assert asyncio.run(scenario()) == 409
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+@pytest.fixture
+def job_types(db, monkeypatch):
+    async def handler(job, progress):
+        return {}
+    monkeypatch.setitem(server.JOB_TYPES, "exclusive", {"handler": handler, "concurrency": 1, "max_attempts": 3})
+    monkeypatch.setitem(server.JOB_TYPES, "paired", {"handler": handler, "concurrency": 2, "max_attempts": 3})
+
+async def enqueue(job_type_name: str, count: int):
+    await server.ensure_job_slots()
+    for _ in range(count):
+        await server.enqueue_job(job_type_name, {})
+
+async def claim_all(worker_count: int) -> list:
+    claims = await asyncio.gather(*(server.claim_job(f"worker-{index}") for index in range(worker_count)))
+    return [job for job in claims if job]
+
+def test_concurrency_limit_holds_across_workers(job_types):
+    async def scenario():
+        await enqueue("exclusive", 3)
+        await enqueue("paired", 3)
+        claimed = await claim_all(6)
+        return sorted(job["type"] for job in claimed)
+
+    assert asyncio.run(scenario()) == ["exclusive", "paired", "paired"]
+
+def test_released_slot_lets_the_next_job_run(job_types):
+    async def scenario():
+        await enqueue("exclusive", 2)
+        first = await server.claim_job("worker-1")
+        blocked = await server.claim_job("worker-2")
+        await server.release_job_slot(first["slot"], "worker-1")
+        second = await server.claim_job("worker-2")
+        return first, blocked, second
+
+    first, blocked, second = asyncio.run(scenario())
+    assert blocked is None
+    assert second is not None and second["id"] != first["id"]
+
+def test_dead_workers_slot_and_job_are_taken_over(job_types):
+    async def scenario():
+        await enqueue("exclusive", 1)
+        job = await server.claim_job("dead-worker")
+        expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+        await server.db.jobs.update_one({"id": job["id"]}, {"$set": {"lease_expires_at": expired}})
+        await server.db.job_slots.update_one({"_id": job["slot"]}, {"$set": {"lease_expires_at": expired}})
+        taken_over = await server.claim_job("worker-2")
+        # The dead worker can no longer release a slot it lost
+        await server.release_job_slot(job["slot"], "dead-worker")
+        slot = await server.db.job_slots.find_one({"_id": job["slot"]})
+        return job, taken_over, slot
+
+    job, taken_over, slot = asyncio.run(scenario())
+    assert taken_over["id"] == job["id"] and taken_over["attempts"] == 2
+    assert slot["lease_owner"] == "worker-2" and slot["job_id"] == job["id"]
+
+def test_jobs_run_to_completion(job_types, client, admin):
+    job = client.post("/api/jobs", json={"type": "exclusive"}, headers=admin).json()
+    for _ in range(100):
+        job = client.get(f"/api/jobs/{job['id']}", headers=admin).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "succeeded" and "slot" not in job
+    slot = asyncio.run(server.db.job_slots.find_one({"_id": "exclusive:0"}))
+    assert slot["job_id"] is None
+
+def test_scheduled_job_is_enqueued_once_per_interval(job_types):
+    async def scenario():
+        await server.create_indexes()
+        racing = await asyncio.gather(*(server.enqueue_scheduled_job("exclusive", 3600) for _ in range(3)))
+        first = next(job for job in racing if job)
+        # Pretend the job started in an earlier interval: the next one still waits for it to finish
+        await server.db.jobs.update_one({"id": first["id"]}, {"$set": {"schedule_key": "exclusive:earlier", "status": "running"}})
+        while_running = await server.enqueue_scheduled_job("exclusive", 3600)
+        await server.db.jobs.update_one({"id": first["id"]}, {"$set": {"status": "succeeded"}})
+        after_finish = await server.enqueue_scheduled_job("exclusive", 3600)
+        return sum(1 for job in racing if job), while_running, after_finish
+
+    enqueued, while_running, after_finish = asyncio.run(scenario())
+    assert enqueued == 1
+    assert while_running is None
+    assert after_finish is not None
+
+def test_worker_survives_bookkeeping_errors(job_types, monkeypatch):
+    update_owned_job = server.update_owned_job
+    failures = []
+
+    async def flaky_update(job_id, worker_id, fields):
+        if fields.get("status") == "succeeded" and not failures:
+            failures.append(job_id)
+            raise ConnectionError("primary stepped down")
+        await update_owned_job(job_id, worker_id, fields)
+
+    monkeypatch.setattr(server, "update_owned_job", flaky_update)
+    monkeypatch.setattr(server, "job_wakeup", asyncio.Event())
+
+    async def scenario():
+        await enqueue("paired", 2)
+        worker = asyncio.create_task(server.job_worker("worker-1"))
+        for _ in range(100):
+            if await server.db.jobs.count_documents({"status": "succeeded"}) == 1:
+                break
+            await asyncio.sleep(0.02)
+        alive = not worker.done()
+        worker.cancel()
+        return alive, await server.db.jobs.count_documents({"status": "succeeded"})
+
+    alive, succeeded = asyncio.run(scenario())
+    assert failures and alive and succeeded == 1
+
+def test_heartbeat_survives_failed_renewals(job_types, monkeypatch):
+    calls = []
+
+    async def failing_update(job_id, worker_id, fields):
+        calls.append(job_id)
+        raise ConnectionError("primary stepped down")
+
+    monkeypatch.setattr(server, "JOB_LEASE_SECONDS", 0.03)
+    monkeypatch.setattr(server, "update_owned_job", failing_update)
+
+    async def scenario():
+        heartbeat = asyncio.create_task(server.renew_job_lease({"id": "job", "slot": "exclusive:0"}, "worker-1"))
+        await asyncio.sleep(0.1)
+        alive = not heartbeat.done()
+        heartbeat.cancel()
+        return alive
+
+    assert asyncio.run(scenario()) and len(calls) >= 2
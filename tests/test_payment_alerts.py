@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+def days_from_today(days: int) -> str:
+    return (datetime.now(timezone.utc).date() + timedelta(days=days)).isoformat()
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    directory = tmp_path / "outbox"
+    monkeypatch.setattr(server, "email_sender", server.create_email_sender(f"file://{directory}"))
+    return directory
+
+@pytest.fixture
+def agency(db):
+    agency = {"id": "agency-1", "agency_name": "Sun Tours", "email": "sun@example.com", "role": "sub_agency"}
+    asyncio.run(db.users.insert_one(dict(agency)))
+    return agency
+
+def add_reservation(db, reservation_id: str, last_date: str, agency_id: str = "agency-1"):
+    asyncio.run(db.reservations.insert_one({
+        "id": reservation_id,
+        "agency_id": agency_id,
+        "agency_name": "Sun Tours",
+        "service_type": "hotel",
+        "tourist_names": "Ann Lee",
+        "date_of_service": days_from_today(30),
+        "last_date_of_payment": last_date,
+        "rest_amount_of_payment": 50.0
+    }))
+
+def notifications(db) -> list:
+    return asyncio.run(db.notifications.find({}, {"_id": 0}).sort("created_at", 1).to_list(None))
+
+def test_items_are_alerted_once_in_one_digest(db, agency, outbox):
+    add_reservation(db, "late", days_from_today(-2))
+    add_reservation(db, "soon", days_from_today(3))
+    add_reservation(db, "later", days_from_today(60))
+
+    first = asyncio.run(server.scan_payment_alerts())
+    second = asyncio.run(server.scan_payment_alerts())
+
+    assert first["alerted"] == 2 and first["emails_sent"] == 1
+    assert second["alerted"] == 0 and second["emails_sent"] == 0
+    [digest] = notifications(db)
+    assert [item["id"] for item in digest["overdue"]] == ["late"]
+    assert [item["id"] for item in digest["upcoming"]] == ["soon"]
+    assert digest["email_status"] == "sent" and digest["email_attempts"] == 1
+    [email] = list(outbox.iterdir())
+    assert "To: sun@example.com" in email.read_text()
+    alerts = asyncio.run(db.payment_alerts.find({}, {"_id": 0}).to_list(None))
+    assert {alert["notification_id"] for alert in alerts} == {digest["id"]}
+
+def test_scan_skips_items_overdue_beyond_the_window(db, agency, outbox):
+    add_reservation(db, "backlog", days_from_today(-server.PAYMENT_ALERT_OVERDUE_DAYS - 1))
+    add_reservation(db, "late", days_from_today(-server.PAYMENT_ALERT_OVERDUE_DAYS))
+
+    result = asyncio.run(server.scan_payment_alerts())
+
+    assert result["candidates"] == 1
+    [digest] = notifications(db)
+    assert [item["id"] for item in digest["overdue"]] == ["late"]
+
+def test_moved_due_date_is_alerted_again(db, agency, outbox):
+    add_reservation(db, "late", days_from_today(-2))
+    asyncio.run(server.scan_payment_alerts())
+    asyncio.run(db.reservations.update_one({"id": "late"}, {"$set": {"last_date_of_payment": days_from_today(-1)}}))
+
+    assert asyncio.run(server.scan_payment_alerts())["alerted"] == 1
+    assert len(list(outbox.iterdir())) == 2
+
+class Delegate:
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+def race_alert_after_notifications(db, monkeypatch, reservation_id: str, kind: str, due_date: str):
+    # Another scan records the same alert between this scan's notification and alert writes
+    class RacingNotifications(Delegate):
+        async def insert_many(self, documents, *args, **kwargs):
+            result = await self.target.insert_many(documents, *args, **kwargs)
+            await db.payment_alerts.insert_one({"reservation_id": reservation_id, "kind": kind, "due_date": due_date})
+            return result
+
+    class RacingDb(Delegate):
+        @property
+        def notifications(self):
+            return RacingNotifications(db.notifications)
+
+    asyncio.run(server.create_indexes())
+    monkeypatch.setattr(server, "db", RacingDb(db))
+
+def test_alert_lost_to_another_scan_is_withdrawn(db, agency, outbox, monkeypatch):
+    add_reservation(db, "late", days_from_today(-2))
+    add_reservation(db, "soon", days_from_today(3))
+    race_alert_after_notifications(db, monkeypatch, "late", "overdue", days_from_today(-2))
+
+    result = asyncio.run(server.scan_payment_alerts())
+
+    assert result["alerted"] == 1
+    [digest] = notifications(db)
+    assert digest["overdue"] == [] and [item["id"] for item in digest["upcoming"]] == ["soon"]
+    [email] = list(outbox.iterdir())
+    assert "overdue" in email.read_text() and "Overdue payments" not in email.read_text()
+
+def test_digest_with_every_alert_lost_is_dropped(db, agency, outbox, monkeypatch):
+    add_reservation(db, "late", days_from_today(-2))
+    race_alert_after_notifications(db, monkeypatch, "late", "overdue", days_from_today(-2))
+
+    result = asyncio.run(server.scan_payment_alerts())
+
+    assert result["alerted"] == 0 and result["notifications"] == 0
+    assert notifications(db) == []
+    assert not outbox.exists()
+
+def test_failed_emails_are_retried_up_to_the_limit(db, agency, monkeypatch):
+    class FailingSender:
+        async def send(self, message):
+            raise OSError("connection refused")
+
+    monkeypatch.setattr(server, "email_sender", FailingSender())
+    add_reservation(db, "late", days_from_today(-2))
+    for _ in range(server.PAYMENT_ALERT_EMAIL_ATTEMPTS + 1):
+        asyncio.run(server.scan_payment_alerts())
+
+    [digest] = notifications(db)
+    assert digest["email_status"] == "failed"
+    assert digest["email_attempts"] == server.PAYMENT_ALERT_EMAIL_ATTEMPTS
+
+def test_claimed_digest_is_sent_once(db, agency, outbox):
+    add_reservation(db, "late", days_from_today(-2))
+    asyncio.run(db.notifications.insert_one({
+        "id": "digest", "agency_id": "agency-1", "agency_name": "Sun Tours", "overdue": [], "upcoming": [],
+        "created_at": datetime.now(timezone.utc).isoformat(), "email_status": "pending", "email_attempts": 0
+    }))
+
+    async def scenario():
+        return await asyncio.gather(*(server.send_pending_notifications() for _ in range(3)))
+
+    assert sum(asyncio.run(scenario())) == 1
+    assert len(list(outbox.iterdir())) == 1
+
+def test_stale_claims_are_taken_over(db, agency, outbox):
+    claimed_at = (datetime.now(timezone.utc) - timedelta(seconds=server.PAYMENT_ALERT_EMAIL_CLAIM_SECONDS + 1)).isoformat()
+    asyncio.run(db.notifications.insert_many([
+        {"id": "stale", "agency_id": "agency-1", "overdue": [], "upcoming": [], "created_at": claimed_at,
+         "email_status": "sending", "email_claimed_at": claimed_at, "email_attempts": 1},
+        {"id": "fresh", "agency_id": "agency-1", "overdue": [], "upcoming": [], "created_at": claimed_at,
+         "email_status": "sending", "email_claimed_at": datetime.now(timezone.utc).isoformat(), "email_attempts": 1}
+    ]))
+
+    assert asyncio.run(server.send_pending_notifications()) == 1
+    assert {digest["id"]: digest["email_status"] for digest in notifications(db)} == {"stale": "sent", "fresh": "sending"}
+
+def test_notification_paging_is_validated(client, admin):
+    for params in ({"limit": 0}, {"page": 0}, {"limit": 101}):
+        assert client.get("/api/notifications", params=params, headers=admin).status_code == 422
+    assert client.get("/api/notifications", params={"limit": 5}, headers=admin).json()["pages"] == 0
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from server import compute_payment_status
+
+def days_from_today(days: int) -> str:
+    return (datetime.now(timezone.utc).date() + timedelta(days=days)).isoformat()
+
+@pytest.mark.parametrize("prepayment, rest, last_date, expected", [
+    (100, 0, days_from_today(-3), "paid"),
+    (30, 70, days_from_today(-3), "overdue"),
+    (30, 70, days_from_today(3), "upcoming"),
+    (30, 70, days_from_today(30), "prepaid"),
+    (0, 100, days_from_today(-3), "overdue"),
+    (0, 100, days_from_today(3), "unpaid"),
+    (30, 70, "not a date", "prepaid"),
+    (0, None, days_from_today(-3), "paid")
+])
+def test_date_only_deadlines(prepayment, rest, last_date, expected):
+    reservation = {"prepayment_amount": prepayment, "rest_amount_of_payment": rest, "last_date_of_payment": last_date}
+    assert compute_payment_status(reservation) == expected
+
+def test_timestamps_with_offsets():
+    deadline = (datetime.now(timezone(timedelta(hours=3))) - timedelta(hours=1)).isoformat()
+    assert compute_payment_status({"prepayment_amount": 10, "rest_amount_of_payment": 5, "last_date_of_payment": deadline}) == "overdue"
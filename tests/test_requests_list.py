@@ -0,0 +1,23 @@
+def test_status_filters_page_and_counts(client, admin, create_agency, create_request):
+    agency = create_agency()
+    ids = [create_request(agency["headers"], location=f"City {i}") for i in range(5)]
+    client.post("/api/requests/bulk-update", json={"ids": ids[:2], "reservation_status": "confirmed"}, headers=admin)
+
+    response = client.get("/api/requests", params={"reservation_status": "confirmed", "limit": 1, "sort_by": "created_at", "sort_order": "asc"}, headers=agency["headers"])
+
+    body = response.json()
+    assert body["total"] == 2 and body["pages"] == 2
+    assert [request["id"] for request in body["requests"]] == [ids[0]]
+    assert body["counts"]["reservation_status"] == {"confirmed": 2, "in_progress": 3}
+
+def test_sub_agencies_only_see_their_requests(client, create_agency, create_request):
+    first = create_agency()
+    second = create_agency("second@example.com")
+    create_request(first["headers"])
+
+    body = client.get("/api/requests", headers=second["headers"]).json()
+    assert body["total"] == 0 and body["requests"] == []
+
+def test_invalid_paging_is_rejected(client, admin):
+    assert client.get("/api/requests", params={"limit": 0}, headers=admin).status_code == 422
+    assert client.get("/api/requests", params={"page": 0}, headers=admin).status_code == 422
@@ -0,0 +1,19 @@
+import pytest
+
+@pytest.mark.parametrize("facets", [None, "service_type"])
+def test_count_strategies(client, admin, create_agency, create_reservation, facets):
+    agency = create_agency()
+    for _ in range(3):
+        create_reservation(agency["id"])
+
+    def fetch(count: str) -> dict:
+        params = {"limit": 2, "count": count, **({"facets": facets} if facets else {})}
+        response = client.get("/api/reservations", params=params, headers=admin)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    exact, cached, has_more = fetch("exact"), fetch("cached"), fetch("has_more")
+
+    assert exact["total"] == cached["total"] == 3 and exact["pages"] == 2
+    assert has_more["total"] is None and has_more["pages"] is None
+    assert all(len(body["reservations"]) == 2 and body["has_more"] for body in (exact, cached, has_more))
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import server
+
+@pytest.fixture(params=["memory://", "fakeredis://"])
+def cache(request):
+    backend = server.create_cache_backend(request.param)
+    if backend.name == "redis":
+        asyncio.run(backend.redis.flushall())
+    return backend
+
+def test_get_returns_what_was_set(cache):
+    async def scenario():
+        missing = await cache.get("key")
+        await cache.set("key", b"value", ["suppliers"], 60)
+        return missing, await cache.get("key")
+
+    assert asyncio.run(scenario()) == (None, b"value")
+
+def test_invalidate_drops_only_tagged_entries(cache):
+    async def scenario():
+        await cache.set("suppliers", b"s", ["suppliers"], 60)
+        await cache.set("bootstrap", b"b", ["suppliers", "users"], 60)
+        await cache.set("users", b"u", ["users"], 60)
+        await cache.invalidate(["suppliers"])
+        return [await cache.get(key) for key in ("suppliers", "bootstrap", "users")]
+
+    assert asyncio.run(scenario()) == [None, None, b"u"]
+
+def test_entries_expire(cache):
+    async def scenario():
+        await cache.set("key", b"value", [], 1)
+        await asyncio.sleep(1.1)
+        return await cache.get("key")
+
+    assert asyncio.run(scenario()) is None
+
+def test_stats_are_reported(cache):
+    assert isinstance(asyncio.run(cache.stats()), dict)
+
+def test_memory_backend_evicts_least_recently_used():
+    cache = server.MemoryCacheBackend(max_bytes=10)
+
+    async def scenario():
+        await cache.set("a", b"aaaa", ["t"], 60)
+        await cache.set("b", b"bbbb", ["t"], 60)
+        await cache.get("a")
+        await cache.set("c", b"cccc", ["t"], 60)
+        await cache.set("too-big", b"x" * 11, ["t"], 60)
+        return [await cache.get(key) for key in ("a", "b", "c", "too-big")]
+
+    assert asyncio.run(scenario()) == [b"aaaa", None, b"cccc", None]
+    assert cache.size == 8 and cache.evictions == 1
+
+@pytest.mark.parametrize("url", ["memory://", "fakeredis://"])
+def test_writes_invalidate_cached_lists(client, admin, monkeypatch, url):
+    backend = server.create_cache_backend(url)
+    if backend.name == "redis":
+        asyncio.run(backend.redis.flushall())
+    monkeypatch.setattr(server, "response_cache", backend)
+
+    assert client.get("/api/suppliers", headers=admin).headers["X-Cache"] == "MISS"
+    assert client.get("/api/suppliers", headers=admin).headers["X-Cache"] == "HIT"
+    client.post("/api/suppliers", json={"name": "Hotel Group"}, headers=admin)
+    response = client.get("/api/suppliers", headers=admin)
+    assert response.headers["X-Cache"] == "MISS"
+    assert [supplier["name"] for supplier in response.json()] == ["Hotel Group"]
+
+    stats = client.get("/api/cache/stats", headers=admin).json()
+    assert stats["backend"] == backend.name
+
+def test_write_by_another_worker_during_a_load_is_not_served(client, admin, monkeypatch):
+    # Another worker shares the Redis cache and the Mongo versions, but not this process's memory
+    monkeypatch.setattr(server, "response_cache", server.create_cache_backend("fakeredis://"))
+    asyncio.run(server.response_cache.redis.flushall())
+    load_suppliers = server.load_suppliers
+
+    async def load_racing_a_write():
+        content = await load_suppliers()
+        await server.db.suppliers.insert_one({"id": "s1", "name": "Hotel Group", "created_at": "2026-01-01"})
+        await server.bump_collection_versions(["suppliers"])
+        await server.response_cache.invalidate(["suppliers"])
+        return content
+
+    monkeypatch.setattr(server, "load_suppliers", load_racing_a_write)
+    stale = client.get("/api/suppliers", headers=admin)
+    monkeypatch.setattr(server, "load_suppliers", load_suppliers)
+
+    response = client.get("/api/suppliers", headers={**admin, "If-None-Match": stale.headers["ETag"]})
+
+    assert stale.json() == []
+    assert response.status_code == 200 and response.headers["X-Cache"] == "MISS"
+    assert [supplier["name"] for supplier in response.json()] == ["Hotel Group"]
+    assert response.headers["ETag"] != stale.headers["ETag"]
@@ -0,0 +1,42 @@
+import io
+
+import pytest
+from fastapi import HTTPException
+from openpyxl import load_workbook
+
+import server
+
+ENTRY = {"agency_id": "agency-1", "date": "2026-03-01", "created_at": "2026-03-01T10:00:00+00:00", "entry_id": "topup-1"}
+
+def test_cursor_round_trip():
+    position = server.decode_statement_cursor(server.encode_statement_cursor(ENTRY, 125.5), "agency-1")
+    assert (position["d"], position["i"], position["b"]) == ("2026-03-01", "topup-1", 125.5)
+
+def test_cursor_is_bound_to_the_agency():
+    with pytest.raises(HTTPException) as error:
+        server.decode_statement_cursor(server.encode_statement_cursor(ENTRY, 0), "agency-2")
+    assert error.value.status_code == 400
+
+def test_expired_cursor(monkeypatch):
+    monkeypatch.setattr(server, "STATEMENT_CURSOR_EXPIRE_MINUTES", -1)
+    cursor = server.encode_statement_cursor(ENTRY, 0)
+    with pytest.raises(HTTPException) as error:
+        server.decode_statement_cursor(cursor, "agency-1")
+    assert error.value.status_code == 410
+
+def test_access_tokens_are_not_cursors():
+    token = server.create_access_token({"sub": "agency-1", "a": "agency-1", "d": "2026-03-01", "i": "x", "b": 0})
+    with pytest.raises(HTTPException) as error:
+        server.decode_statement_cursor(token, "agency-1")
+    assert error.value.status_code == 400
+
+def test_cursors_are_not_access_tokens(client):
+    cursor = server.encode_statement_cursor(ENTRY, 0)
+    response = client.get("/api/auth/me", headers={"Authorization": f"Bearer {cursor}"})
+    assert response.status_code == 401
+
+def test_statement_xlsx_bytes():
+    content = server.statement_xlsx_bytes([["2026-03-01", "topup", "Top-up", 100.0, 100.0, "topup-1"]])
+    sheet = load_workbook(io.BytesIO(content)).active
+    assert [cell.value for cell in sheet[1]] == server.STATEMENT_COLUMNS
+    assert sheet["D2"].value == 100.0
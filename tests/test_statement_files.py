@@ -0,0 +1,32 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import server
+
+HEADER = {"title": "Agency statement 2026-03", "opening_balance": 0.0, "closing_balance": 90.0}
+ROWS = [
+    ["2026-03-01", "topup", "Top-up", 100.0, 100.0, "topup-1"],
+    ["2026-03-02", "expense", None, None, 90.0, "expense-1"]
+]
+
+@pytest.mark.parametrize("file_format", ["pdf", "xlsx"])
+def test_render_tolerates_missing_values(tmp_path, file_format):
+    path = tmp_path / f"statement.{file_format}"
+    server.render_statement_file(str(path), file_format, HEADER, ROWS)
+    assert path.stat().st_size > 0
+    assert os.listdir(tmp_path) == [path.name]
+
+def test_concurrent_renders_do_not_share_a_temp_file(tmp_path):
+    path = str(tmp_path / "statement.pdf")
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda _: server.render_statement_file(path, "pdf", HEADER, ROWS * 200), range(4)))
+    assert os.listdir(tmp_path) == ["statement.pdf"]
+    with open(path, "rb") as f:
+        assert f.read(5) == b"%PDF-"
+
+def test_failed_render_leaves_no_temp_file(tmp_path):
+    with pytest.raises(Exception):
+        server.render_statement_file(str(tmp_path / "statement.pdf"), "pdf", HEADER, [["2026-03-01", "topup", "x", "not a number", 1.0, "id"]])
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+@pytest.fixture(autouse=True)
+def no_overlap(monkeypatch):
+    # Without the overlap window every sync only returns what changed after the previous one
+    monkeypatch.setattr(server, "SYNC_OVERLAP_SECONDS", 0)
+
+def sync(client, headers: dict, since: str = None) -> dict:
+    response = client.get("/api/sync", params={"since": since} if since else {}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_incremental_sync_returns_changes_and_deletions(client, admin, create_agency, create_request):
+    agency = create_agency()
+    first = create_request(agency["headers"])
+    full = sync(client, admin)
+    assert [request["id"] for request in full["changes"]["requests"]] == [first]
+
+    second = create_request(agency["headers"])
+    client.put(f"/api/requests/{first}", json={"reservation_status": "confirmed"}, headers=admin)
+    expense = client.post("/api/expenses", json={"agency_id": agency["id"], "amount": 5, "date": "2026-02-01", "description": "Fee"}, headers=admin).json()
+    client.delete(f"/api/expenses/{expense['id']}", headers=admin)
+    delta = sync(client, admin, full["next"])
+
+    assert sorted(request["id"] for request in delta["changes"]["requests"]) == sorted([first, second])
+    assert delta["deleted"]["expenses"] == [expense["id"]]
+    assert sync(client, admin, delta["next"])["changes"]["requests"] == []
+
+def test_sub_agency_only_syncs_its_own_records(client, create_agency, create_request):
+    agency = create_agency()
+    other = create_agency("other@example.com")
+    own = create_request(agency["headers"])
+    create_request(other["headers"])
+
+    assert [request["id"] for request in sync(client, agency["headers"])["changes"]["requests"]] == [own]
+
+def test_tokens_are_bound_to_their_user(client, admin, create_agency):
+    agency = create_agency()
+    token = sync(client, admin)["next"]
+
+    response = client.get("/api/sync", params={"since": token}, headers=agency["headers"])
+
+    assert response.status_code == 400
+
+def test_access_tokens_are_not_sync_tokens(client, admin):
+    response = client.get("/api/sync", params={"since": admin["Authorization"].split()[1]}, headers=admin)
+    assert response.status_code == 400
+
+def test_tokens_expire_with_the_tombstones(client, admin):
+    admin_user = {"id": client.get("/api/auth/me", headers=admin).json()["id"]}
+    issued_at = datetime.now(timezone.utc) - timedelta(days=server.SYNC_TOMBSTONE_DAYS + 1)
+    token = server.encode_sync_token(admin_user, {}, issued_at)
+
+    response = client.get("/api/sync", params={"since": token}, headers=admin)
+
+    assert response.status_code == 410
@@ -0,0 +1,44 @@
+from tests.conftest import ADMIN_EMAIL, ADMIN_PASSWORD, auth_headers, login
+
+def refresh(client, tokens: dict):
+    return client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+
+def test_refresh_rotates_tokens(client):
+    tokens = login(client, ADMIN_EMAIL, ADMIN_PASSWORD)
+
+    response = refresh(client, tokens)
+
+    assert response.status_code == 200
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    assert client.get("/api/auth/me", headers=auth_headers(rotated)).status_code == 200
+    assert refresh(client, rotated).status_code == 200
+
+def test_reused_refresh_token_revokes_every_session(client):
+    stolen = login(client, ADMIN_EMAIL, ADMIN_PASSWORD)
+    other_session = login(client, ADMIN_EMAIL, ADMIN_PASSWORD)
+    rotated = refresh(client, stolen).json()
+
+    response = refresh(client, stolen)
+
+    assert response.status_code == 401
+    assert client.get("/api/auth/me", headers=auth_headers(rotated)).status_code == 401
+    assert refresh(client, rotated).status_code == 401
+    assert refresh(client, other_session).status_code == 401
+    assert login(client, ADMIN_EMAIL, ADMIN_PASSWORD)["access_token"]
+
+def test_access_token_is_not_a_refresh_token(client):
+    tokens = login(client, ADMIN_EMAIL, ADMIN_PASSWORD)
+    response = client.post("/api/auth/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 401
+
+def test_password_change_revokes_refresh_tokens(client, create_agency):
+    create_agency("agency@example.com", "secret")
+    tokens = login(client, "agency@example.com", "secret")
+    other_session = login(client, "agency@example.com", "secret")
+
+    response = client.post("/api/auth/change-password", json={"old_password": "secret", "new_password": "changed"}, headers=auth_headers(tokens))
+
+    assert response.status_code == 200
+    assert refresh(client, other_session).status_code == 401
+    assert refresh(client, response.json()).status_code == 200